@@ -1,110 +1,619 @@
 from flask import Flask, request, jsonify
+from concurrent.futures import ThreadPoolExecutor
 from threading import Lock
+import hashlib
+import json
+import os
 import re
 import requests
 
+from frozen import FrozenRun
+from message import MessageIndex
+from period import PeriodCache, get_period_algorithm, instruction_period
+from store import FrozenSteps, make_store
+
 OWNER_MANUAL_URL = (
     "https://gitea-gitea.apps.cluster-vwppf.vwppf.sandbox2632.opentlc.com/"
     "starter/INSTRUCTIONS/raw/branch/master/resources/quantumpulse-3000.md"
 )
-app = Flask(__name__)
 
-# Live accumulation
-seq_to_instr = {}
+# Streaming ingestion: records are applied in groups to keep lock traffic low,
+# and a single NDJSON line may not exceed this many bytes.
+STREAM_GROUP_SIZE = 1000
+STREAM_MAX_LINE_BYTES = 64 * 1024
+
+# Streamed /instructions responses (?stream=true) are serialized this many
+# steps at a time; live runs take store_lock once per chunk, not per download.
+STREAM_RESPONSE_CHUNK = 10000
+
+# Largest accepted seq; anything above is rejected at ingest so one stray value
+# cannot make the in-progress view allocate a list sized by it.
+MAX_SEQ_SPAN = int(os.environ.get("MAX_SEQ_SPAN", "10000000"))
+
+# Smallest accepted seq: durable stores keep seqs as int64 (SQLite INTEGER,
+# LogStore's "q" header field), so lower values would fail in the writer thread
+MIN_SEQ = -(2 ** 63)
+
+# Character-level period algorithm used at freeze time (see period.PERIOD_ALGORITHMS)
+PERIOD_ALGORITHM = os.environ.get("PERIOD_ALGORITHM", "divisor")
+unit_length = get_period_algorithm(PERIOD_ALGORITHM)
+
+# Opt-in early period report: once the contiguous prefix is at least this many
+# full copies of its smallest period, /count and /analysis/period publish that
+# unit before the run completes (0 = off; implies ONLINE_PERIOD, see
+# message.py). The freeze analysis stays authoritative.
+EARLY_PERIOD_REPEATS = int(os.environ.get("EARLY_PERIOD_REPEATS", "0"))
+
+# Freeze-time period results of recent runs, keyed by a digest of the message
+# and its step boundaries (PERIOD_CACHE_SIZE=0 disables). Runs adopted from
+# FROZEN_RUN_PATH or recovered with their analysis done seed it too
+PERIOD_CACHE_SIZE = int(os.environ.get("PERIOD_CACHE_SIZE", "64"))
+period_cache = PeriodCache(PERIOD_CACHE_SIZE)
+
+app = Flask(__name__)
 
-# Frozen, persistent results after finalization
-final_instructions = None   # list[str] once frozen
-final_count = None          # int once frozen
-finalized = False           # True after terminator finalizes the run
+# Instruction store backend (see store.STORES); every access holds store_lock
+INSTRUCTION_STORE = os.environ.get("INSTRUCTION_STORE", "memory")
+store = make_store(INSTRUCTION_STORE)
 
 store_lock = Lock()
 
-def repeating_unit_length(s: str) -> int:
-    if not s:
-        return 0
-    pi = [0] * len(s)
-    for i in range(1, len(s)):
-        j = pi[i - 1]
-        while j > 0 and s[i] != s[j]:
-            j = pi[j - 1]
-        if s[i] == s[j]:
-            j += 1
-        pi[i] = j
-    n = len(s)
-    period = n - pi[-1]
-    return period if n % period == 0 else n
+# Optional file the frozen run is written to and then served from via mmap, so
+# a restarted or sibling worker process can pick it up without re-ingestion
+FROZEN_RUN_PATH = os.environ.get("FROZEN_RUN_PATH", "")
 
-@app.route("/instruction", methods=["POST"])
-def instruction():
-    global final_instructions, final_count, finalized
+# Finalized responses never change, so each variant is serialized once:
+# variant -> (JSON body bytes, strong ETag). Cleared on reset, and replaced
+# once the freeze-time analysis has filled in the summary.
+final_responses = {}
 
-    if not request.is_json:
-        return jsonify({"error": "Request must be JSON"}), 400
-    data = request.get_json()
+# Freeze-time message statistics are computed here, off store_lock. Each freeze
+# (and each reset) bumps analysis_generation so results of a reset run are dropped.
+analysis_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="analysis")
+analysis_generation = 0
 
-    if "seq" not in data or "instruction" not in data:
-        return jsonify({"error": "JSON must include 'seq' and 'instruction'"}), 400
+def _finalize_if_complete():
+    """
+    Freeze the run if a terminator is pending and steps 1..(final_seq-1) are
+    all present. Returns the finalize summary, or None if still incomplete.
+    Must be called with store_lock held.
+    """
+    final_seq = store.pending_final_seq
+    if final_seq is None or store.watermark() < final_seq - 1:
+        return None
+
+    # Freeze results permanently: only a view of the live map is recorded here;
+    # the frozen list and the message statistics follow on analysis_pool so
+    # the terminator is answered now
+    store.freeze(final_seq)
+    summary = {
+        "status": "finalized",
+        "final_seq": final_seq,
+        "steps_counted": store.final_count,
+        "message_length": store.prefix.offsets[store.final_count],
+        "analysis": "pending",
+    }
+    store.record_summary(summary)
+    _start_analysis()
+    return summary
+
+def _start_analysis() -> None:
+    """
+    Queue the freeze-time analysis of the finalized run. Must be called with
+    store_lock held.
+    """
+    global analysis_generation
+    analysis_generation += 1
+    analysis_pool.submit(
+        _analyze_frozen, analysis_generation, store.final_instructions,
+        store.prefix, dict(store.final_summary),
+    )
+
+def _analyze_frozen(generation: int, ordered, prefix, summary: dict) -> None:
+    """
+    Runs on analysis_pool. A frozen run and its prefix index no longer change
+    (reset swaps in new objects), so everything here reads them without
+    store_lock; the lock is taken only to publish the results.
+    """
+    staged = None
+    try:
+        # Freezing only recorded a view of the live map; the copy is made here
+        built = isinstance(ordered, FrozenSteps)
+        if built:
+            ordered = list(ordered)
+        # "failed" is retried: a restart may succeed where the last attempt did not
+        computed = summary.get("analysis", "ready") != "ready"
+        if computed:
+            summary = dict(summary, analysis="ready", **_period_stats(ordered, prefix, summary))
+        elif period_cache.maxsize > 0:
+            # Analysed by an earlier process: remember the result so the same
+            # content ingested again after /reset is a cache hit
+            key = _run_key(ordered, prefix)
+            if key is not None:
+                period_cache.put(key, (summary["repeating_unit_steps"], summary["repeating_unit_length"]))
+
+        # An adopted FrozenRun is already on disk; only its responses are built
+        if FROZEN_RUN_PATH and not isinstance(ordered, FrozenRun):
+            # Staged beside FROZEN_RUN_PATH and renamed into place under
+            # store_lock only if the run is still current: readers adopt that
+            # path, so a reset run must never appear there
+            staged = FROZEN_RUN_PATH + ".staged"
+            FrozenRun.write(staged, summary["final_seq"], ordered, summary)
+        # Runs served from FROZEN_RUN_PATH stream their listings from the map
+        responses = _serialize_final(ordered, summary, prefix, streamed=bool(FROZEN_RUN_PATH))
+
+        with store_lock:
+            if generation != analysis_generation:
+                # Reset while we were working: drop the stale results
+                if staged is not None:
+                    os.remove(staged)
+                return
+            if computed:
+                store.record_summary(summary)
+            if staged is not None:
+                os.replace(staged, FROZEN_RUN_PATH)
+                store.adopt_frozen(summary["final_seq"], FrozenRun(FROZEN_RUN_PATH), summary)
+            elif built:
+                store.adopt_frozen(summary["final_seq"], ordered, summary)
+            final_responses.clear()
+            final_responses.update(responses)
+            ticket = store.commit_point()
+        store.wait_committed(ticket)
+    except Exception as e:
+        app.logger.exception("freeze-time analysis failed")
+        if staged is not None and os.path.exists(staged):
+            os.remove(staged)
+        # Recorded so /analysis reports the failure instead of staying pending
+        with store_lock:
+            if generation != analysis_generation:
+                return
+            store.record_summary(dict(summary, analysis="failed", error=f"{type(e).__name__}: {e}"))
+
+def _run_key(ordered, prefix):
+    """period_cache key of a frozen run, or None if neither index covers it."""
+    if isinstance(ordered, FrozenRun):
+        return ordered.digest(len(ordered))
+    if prefix.steps >= len(ordered):
+        return prefix.digest(len(ordered))
+    return None
+
+def _period_stats(ordered, prefix, summary: dict) -> dict:
+    """Repeating unit of a frozen run in characters and in instructions."""
+    key = _run_key(ordered, prefix)
+    cached = period_cache.get(key) if key is not None else None
+    if cached is not None:
+        unit_steps, base_len = cached
+    else:
+        unit_steps = instruction_period(ordered)
+        # Already known if the prefix function was advanced during ingestion;
+        # otherwise it divides the instruction-level unit and is confirmed there
+        base_len = prefix.unit_length(summary["message_length"])
+        if base_len is None:
+            base_len = unit_length("".join(ordered[:unit_steps]))
+        if key is not None:
+            period_cache.put(key, (unit_steps, base_len))
+    return {"repeating_unit_length": base_len, "repeating_unit_steps": unit_steps}
+
+def _serialize_final(frozen, summary: dict, prefix=None, streamed: bool = None) -> dict:
+    """
+    Every finalized read variant: variant -> (JSON body bytes, strong ETag).
+    With `streamed` (the default for a FrozenRun) the two listings are only
+    hashed and their body is None: they are streamed from the mapped run per
+    request, so no process keeps a private copy of it.
+    """
+    if streamed is None:
+        streamed = isinstance(frozen, FrozenRun)
+    count = len(frozen)
+    if isinstance(frozen, FrozenRun):
+        index = frozen
+    elif prefix is not None and prefix.steps >= count:
+        index = prefix
+    else:
+        index = MessageIndex(track_period=False)
+        for instr in frozen:
+            index.append(instr)
+
+    variants = {
+        "count": {
+            "instruction_count": count,
+            "status": "final",
+            "finalization": summary,
+        },
+    }
+    if not streamed:
+        listing = {
+            "instructions": list(frozen),
+            "status": "final",
+            "count": count,
+            "finalization": summary,
+        }
+        variants["instructions"] = listing
+        variants["instructions+concat"] = dict(listing, message=index.substring(0, index.offsets[count]))
+    if "repeating_unit_length" in summary:
+        variants["period"] = _period_analysis(index, summary)
+    responses = {}
+    for variant, obj in variants.items():
+        body = app.json.response(obj).get_data()
+        responses[variant] = (body, hashlib.sha256(body).hexdigest())
+    if streamed:
+        for variant, concat in (("instructions", False), ("instructions+concat", True)):
+            digest = hashlib.sha256()
+            for piece in _json_chunks(_final_doc(frozen, summary, 1, count, concat, False)):
+                digest.update(piece.encode("utf-8"))
+            responses[variant] = (None, digest.hexdigest())
+    return responses
+
+def _period_analysis(index, summary: dict) -> dict:
+    """
+    The repeating unit of a finalized run. When the unit ends on a step
+    boundary (per the run's char offsets, as in _early_period) it is reported
+    as the seq span 1..that step instead of as text. `index` is a
+    MessageIndex or FrozenRun covering the run.
+    """
+    unit_len = summary["repeating_unit_length"]
+    length = summary["message_length"]
+    repeats = length // unit_len if unit_len else 0
+    analysis = {
+        "status": "final",
+        "final_seq": summary["final_seq"],
+        "message_length": length,
+        "unit_length": unit_len,
+        "repeat_count": repeats,
+        "perfect_power": repeats > 1,
+    }
+    unit_steps = index.step_at(unit_len - 1) if unit_len else 0
+    if unit_steps and index.offsets[unit_steps] == unit_len:
+        analysis["unit_span"] = {"from": 1, "to": unit_steps, "steps": unit_steps}
+    else:
+        analysis["unit"] = index.substring(0, unit_len)
+    return analysis
+
+def _early_period():
+    """
+    Provisional period of the contiguous prefix for EARLY_PERIOD_REPEATS, or
+    None when the mode is off or the prefix function is not tracked.
+    Must be called with store_lock held.
+    """
+    prefix = store.prefix
+    candidate = prefix.period() if EARLY_PERIOD_REPEATS > 0 else None
+    if candidate is None:
+        return None
+    unit_len, repeats = candidate
+    early = {
+        "status": "stable" if repeats >= EARLY_PERIOD_REPEATS else "tracking",
+        "watermark": prefix.steps,
+        "unit_length": unit_len,
+        "repeat_count": repeats,
+        "required_repeats": EARLY_PERIOD_REPEATS,
+    }
+    if early["status"] == "stable":
+        unit_steps = prefix.step_at(unit_len - 1)
+        if prefix.offsets[unit_steps] == unit_len:
+            early["unit_span"] = {"from": 1, "to": unit_steps, "steps": unit_steps}
+        else:
+            early["unit"] = prefix.substring(0, unit_len)
+    return early
+
+def _resume_early_period() -> None:
+    """
+    Restart prefix-function tracking on a run recovered by a durable store
+    (replay skips it), so the early period report keeps working for the
+    rest of the run. Must be called with store_lock held.
+    """
+    if EARLY_PERIOD_REPEATS > 0 and not store.finalized and store.prefix.kmp is None:
+        store.prefix.start_period_tracking()
+
+def _final_etag(variant: str = "instructions") -> str:
+    """
+    ETag of a finalized view: the published variant's strong ETag, or the
+    versioned one until the analysis worker has published them.
+    Must be called with store_lock held.
+    """
+    if final_responses:
+        return final_responses[variant][1]
+    return _live_etag()
+
+def _final_response(variant: str):
+    """
+    Finalized response, or 304 if the client already has it. Until the worker
+    publishes the serialized variants, the count is built per request and the
+    full listings are streamed, so nothing O(n) runs under store_lock.
+    Must be called with store_lock held.
+    """
+    if variant in final_responses:
+        body, etag = final_responses[variant]
+        if body is None:
+            return _stream_final(1, None, variant == "instructions+concat", False)
+        resp = app.response_class(body, mimetype="application/json")
+        resp.set_etag(etag)
+        return resp.make_conditional(request)
+    if variant != "count":
+        return _stream_final(1, None, variant == "instructions+concat", False)
+
+    etag = _final_etag()
+    if etag in request.if_none_match:
+        return _not_modified(etag)
+    resp = jsonify({
+        "instruction_count": store.final_count,
+        "status": "final",
+        "finalization": store.final_summary,
+    })
+    resp.set_etag(etag)
+    return resp
+
+# Modification time of a FROZEN_RUN_PATH file that failed to open, so it is
+# reported once rather than retried on every request
+_unreadable_frozen = {"mtime": None}
+
+def _adopt_frozen_run() -> None:
+    """
+    Pick up a run frozen by an earlier or sibling process from FROZEN_RUN_PATH.
+    Must be called with store_lock held.
+    """
+    if not FROZEN_RUN_PATH or store.finalized or not os.path.exists(FROZEN_RUN_PATH):
+        return
+    stamp = os.stat(FROZEN_RUN_PATH).st_mtime_ns
+    if stamp == _unreadable_frozen["mtime"]:
+        return
+    try:
+        frozen = FrozenRun(FROZEN_RUN_PATH)
+    except ValueError:
+        # e.g. written in an older format; the next freeze replaces it
+        app.logger.warning("ignoring unreadable frozen run file %s", FROZEN_RUN_PATH)
+        _unreadable_frozen["mtime"] = stamp
+        return
+    store.adopt_frozen(frozen.final_seq, frozen, frozen.summary)
+    _start_analysis()
+
+def _parse_step(data):
+    """Validate one {seq, instruction} object; raises ValueError with the reason."""
+    if not isinstance(data, dict) or "seq" not in data or "instruction" not in data:
+        raise ValueError("JSON must include 'seq' and 'instruction'")
 
     try:
         seq = int(data["seq"])
     except (ValueError, TypeError):
-        return jsonify({"error": "'seq' must be an integer"}), 400
+        raise ValueError("'seq' must be an integer")
+    if seq > MAX_SEQ_SPAN:
+        raise ValueError(f"'seq' must not exceed {MAX_SEQ_SPAN}")
+    if seq < MIN_SEQ:
+        raise ValueError(f"'seq' must be at least {MIN_SEQ}")
 
     instr = data["instruction"]
     if not isinstance(instr, str):
-        return jsonify({"error": "'instruction' must be a string"}), 400
+        raise ValueError("'instruction' must be a string")
+    try:
+        instr.encode("utf-8")
+    except UnicodeEncodeError:
+        # e.g. a lone surrogate from a "\ud800" escape: valid JSON, not UTF-8
+        raise ValueError("'instruction' must be valid Unicode text")
+    return seq, instr
+
+def _apply_steps(steps) -> dict:
+    """
+    Upsert validated (seq, instruction) pairs in order with the same rules as
+    /instruction: a terminator becomes the pending final_seq and the run freezes
+    as soon as it is complete. Steps after the freeze are ignored.
+    Must be called with store_lock held.
+    """
+    accepted = 0
+    summary = None
+    for seq, instr in steps:
+        if store.finalized:
+            break
+        store.upsert(seq, instr)
+        accepted += 1
+        if instr == "":
+            store.set_pending(seq)
+        if store.pending_final_seq is not None:
+            summary = _finalize_if_complete()
+    return {"accepted": accepted, "ignored": len(steps) - accepted, "finalization": summary}
+
+def _batch_response(result: dict, **rejected) -> tuple:
+    """
+    Compact per-batch response shared by the batch and stream endpoints.
+    `rejected` is the endpoint's own report of invalid items (its keys differ:
+    a list of indices for batches, a count for streams).
+    """
+    resp = {
+        "accepted": result["accepted"],
+        **rejected,
+        "ignored": result["ignored"],
+    }
+    if result["finalization"] is not None:
+        resp["status"] = "finalized"
+        resp["finalization"] = result["finalization"]
+        return resp, 200
+    if store.finalized:
+        resp["status"] = "ignored"
+        resp["reason"] = "sequence finalized"
+        return resp, 409
+
+    resp["status"] = "accepted"
+    resp["watermark"] = store.watermark()
+    if store.pending_final_seq is not None:
+        resp["final_seq"] = store.pending_final_seq
+        resp["missing_count"] = store.missing_before(store.pending_final_seq)
+    return resp, 202
+
+def _ingest_one(seq: int, instr: str) -> tuple:
+    """Apply a single /instruction step. Must be called with store_lock held."""
+    if store.finalized:
+        # Ignore any further writes after we’ve frozen the result.
+        return {"status": "ignored", "reason": "sequence finalized"}, 409
+
+    # Upsert the step
+    store.upsert(seq, instr)
+
+    if instr == "":
+        # Terminator: remember it so the run freezes as soon as it is complete
+        store.set_pending(seq)
+    elif store.pending_final_seq is None:
+        # No terminator seen yet, just acknowledge
+        return {"status": "accepted", "seq": seq}, 202
+
+    summary = _finalize_if_complete()
+    if summary is not None:
+        return summary, 200
+
+    if instr != "":
+        return {"status": "accepted", "seq": seq}, 202
+
+    # Don’t freeze; allow more steps to arrive
+    final_seq = store.pending_final_seq
+    return {
+        "status": "incomplete",
+        "final_seq": final_seq,
+        "watermark": store.watermark(),
+        "missing_count": store.missing_before(final_seq),
+        "missing_first_10": store.first_missing_before(final_seq, 10),
+    }, 409
+
+@app.route("/instruction", methods=["POST"])
+def instruction():
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+    try:
+        seq, instr = _parse_step(request.get_json())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     with store_lock:
-        if finalized:
-            # Ignore any further writes after we’ve frozen the result.
-            return jsonify({"status": "ignored", "reason": "sequence finalized"}), 409
-
-        # Upsert the step
-        seq_to_instr[seq] = instr
-
-        # If not the terminator, just acknowledge
-        if instr != "":
-            return jsonify({"status": "accepted", "seq": seq}), 202
-
-        # Terminator received → check completeness for steps 1..(seq-1)
-        final_seq = seq
-        ordered = [seq_to_instr.get(i, "") for i in range(1, final_seq)]
-        missing = [i for i, v in enumerate(ordered, start=1) if v == ""]
-
-        if missing:
-            # Don’t freeze; allow more steps to arrive
-            return jsonify({
-                "status": "incomplete",
-                "final_seq": final_seq,
-                "missing_count": len(missing),
-                "missing_first_10": missing[:10],
-            }), 409
-
-        # Freeze results permanently
-        final_instructions = ordered
-        final_count = len(ordered)
-        finalized = True
-
-        # Optional: compute repeating length (kept for your visibility)
-        message = "".join(ordered)
-        base_len = repeating_unit_length(message)
+        resp, status = _ingest_one(seq, instr)
+        ticket = store.commit_point()
+    # Acknowledge only once the write is durable (immediate for the memory store)
+    store.wait_committed(ticket)
+    return jsonify(resp), status
 
-        return jsonify({
-            "status": "finalized",
-            "final_seq": final_seq,
-            "steps_counted": final_count,
-            "message_length": len(message),
-            "repeating_unit_length": base_len
-        }), 200
+@app.route("/instructions/batch", methods=["POST"])
+def instructions_batch():
+    """
+    Upserts many steps under a single store_lock acquisition.
+    Body: JSON array of {"seq": int, "instruction": str} objects; a terminator
+    inside the batch follows the same finalize rules as /instruction.
+    Invalid items are skipped and reported by index in `rejected`.
+    """
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+    data = request.get_json()
+    if not isinstance(data, list):
+        return jsonify({"error": "JSON body must be an array of steps"}), 400
+
+    steps, rejected = [], []
+    for i, item in enumerate(data):
+        try:
+            steps.append(_parse_step(item))
+        except ValueError:
+            rejected.append(i)
+
+    with store_lock:
+        resp, status = _batch_response(_apply_steps(steps), rejected=rejected)
+        ticket = store.commit_point()
+    store.wait_committed(ticket)
+    return jsonify(resp), status
+
+def _iter_ndjson_lines(stream):
+    """Yield (line_no, raw_line) from a byte stream, None for oversized lines."""
+    line_no = 0
+    while True:
+        line = stream.readline(STREAM_MAX_LINE_BYTES + 1)
+        if not line:
+            return
+        line_no += 1
+        if len(line) > STREAM_MAX_LINE_BYTES and not line.endswith(b"\n"):
+            # Drain the rest of the oversized line without buffering it
+            while line and not line.endswith(b"\n"):
+                line = stream.readline(STREAM_MAX_LINE_BYTES)
+            yield line_no, None
+            continue
+        yield line_no, line
+
+@app.route("/instructions/stream", methods=["POST"])
+def instructions_stream():
+    """
+    Upserts steps from a (possibly chunked) newline-delimited JSON body, one
+    {"seq": int, "instruction": str} object per line. Records are read as they
+    arrive and applied in groups of STREAM_GROUP_SIZE, so memory stays bounded
+    regardless of body size. Blank lines are skipped; invalid lines are counted
+    in `rejected_count` and the first few line numbers reported.
+    """
+    totals = {"accepted": 0, "ignored": 0, "finalization": None}
+    rejected = 0
+    rejected_lines = []
+
+    def flush(group):
+        with store_lock:
+            result = _apply_steps(group)
+        totals["accepted"] += result["accepted"]
+        totals["ignored"] += result["ignored"]
+        if result["finalization"] is not None:
+            totals["finalization"] = result["finalization"]
+
+    group = []
+    for line_no, line in _iter_ndjson_lines(request.stream):
+        if line is not None and not line.strip():
+            continue
+        try:
+            if line is None:
+                raise ValueError("line too long")
+            group.append(_parse_step(json.loads(line)))
+        except (ValueError, RecursionError):
+            # RecursionError: deeply nested JSON that still fits the line limit
+            rejected += 1
+            if len(rejected_lines) < 10:
+                rejected_lines.append(line_no)
+            continue
+        if len(group) >= STREAM_GROUP_SIZE:
+            flush(group)
+            group = []
+    if group:
+        flush(group)
+
+    with store_lock:
+        resp, status = _batch_response(totals, rejected_count=rejected, rejected_first_10=rejected_lines)
+        resp["watermark"] = store.watermark()
+        resp["finalized"] = totals["finalization"] is not None
+        ticket = store.commit_point()
+    store.wait_committed(ticket)
+    return jsonify(resp), status
+
+def _live_etag() -> str:
+    """ETag for in-progress views: changes whenever the store's version does."""
+    return f"{store.epoch}-{store.version}"
+
+def _live_total() -> int:
+    """Non-empty steps in 1..max_key of the in-progress view, whatever the window."""
+    return store.max_seq - store.gap_total
+
+def _not_modified(etag: str):
+    resp = app.response_class(status=304)
+    resp.set_etag(etag)
+    return resp
 
 @app.route("/count", methods=["GET"])
 def count_instructions():
     with store_lock:
-        if finalized:
-            return jsonify({"instruction_count": final_count, "status": "final"}), 200
+        _adopt_frozen_run()
+        if store.finalized:
+            return _final_response("count")
+        etag = _live_etag()
+        if etag in request.if_none_match:
+            return _not_modified(etag)
         # Live (pre-finalization) count excludes any empty strings
-        live_count = sum(1 for v in seq_to_instr.values() if v != "")
-        return jsonify({"instruction_count": live_count, "status": "in-progress"}), 200
+        body = {
+            "instruction_count": store.live_count,
+            "status": "in-progress",
+            "watermark": store.watermark(),
+            "gap_count": store.gap_total,
+            # Repeating unit of the contiguous prefix so far (null if not tracked)
+            "prefix_repeating_unit_length": store.prefix.unit_length(store.prefix.length),
+        }
+        early = _early_period()
+        if early is not None:
+            body["early_period"] = early
+        resp = jsonify(body)
+    resp.set_etag(etag)
+    return resp, 200
 
 @app.route("/instructions", methods=["GET"])
 def list_instructions():
@@ -112,47 +621,401 @@ def list_instructions():
     Returns instructions in order.
     - After finalization: persistent frozen list
     - Before finalization: current view with missing indices
-    Query param: ?concat=true to include concatenated message
+    Query params:
+      - concat=true to include concatenated message
+      - missing=ranges to report gaps as [start, end] intervals instead of
+        listing every missing seq (in-progress view only)
+      - layout=sparse to return present steps as {"start", "instructions"} runs
+        instead of a dense list padded with "" (in-progress view only; implies
+        missing=ranges), so cost follows stored steps plus gaps
+      - stream=true to send the same document incrementally with bounded
+        memory (dense layout only). A live run is read chunk by chunk, so steps
+        landing mid-download may or may not appear; count and missing are
+        taken when the download starts
+      - from=&to= to return only seqs from..to (inclusive, either bound
+        optional); cost follows the window, gap info is limited to it, and
+        `next_from` is the cursor for the following page (null at the end).
+        `count` stays the whole run's; `window_count` counts the page's steps
     """
     concat = request.args.get("concat", "false").lower() == "true"
+    missing_mode = request.args.get("missing", "list").lower()
+    if missing_mode not in ("list", "ranges"):
+        return jsonify({"error": "missing must be 'list' or 'ranges'"}), 400
+    layout = request.args.get("layout", "dense").lower()
+    if layout not in ("dense", "sparse"):
+        return jsonify({"error": "layout must be 'dense' or 'sparse'"}), 400
+    if layout == "sparse":
+        missing_mode = "ranges"
+
+    stream = request.args.get("stream", "false").lower() == "true"
+    if stream and layout == "sparse":
+        return jsonify({"error": "stream=true supports the dense layout only"}), 400
+
+    windowed = "from" in request.args or "to" in request.args
+    try:
+        lo = int(request.args.get("from", "1"))
+        hi = int(request.args["to"]) if "to" in request.args else None
+    except ValueError:
+        return jsonify({"error": "from and to must be integers"}), 400
+    if lo < 1 or (hi is not None and hi < lo):
+        return jsonify({"error": "from must be >= 1 and to must be >= from"}), 400
+
+    with store_lock:
+        _adopt_frozen_run()
+        if store.finalized:
+            if stream:
+                return _stream_final(lo, hi, concat, windowed)
+            if not windowed:
+                return _final_response("instructions+concat" if concat else "instructions")
+            return _final_window(lo, hi, concat)
+
+        # Nothing changed since the client's copy: skip building the view
+        etag = _live_etag()
+        if etag in request.if_none_match:
+            return _not_modified(etag)
+
+        if store.is_empty():
+            resp = jsonify({"instructions": [], "status": "in-progress", "count": 0})
+            resp.set_etag(etag)
+            return resp, 200
+
+        if stream:
+            return _stream_live(lo, hi, concat, missing_mode, windowed, etag)
+
+        # Build from present runs and gap intervals rather than probing every seq
+        end = store.max_key if hi is None else min(hi, store.max_key)
+        runs = [
+            {"start": start, "instructions": store.get_range(start, stop)}
+            for start, stop in store.present_runs(end, lo)
+        ]
+        missing_ranges = store.gap_ranges(end, lo)
+        missing_count = sum(stop - start + 1 for start, stop in missing_ranges)
+        size = max(end - lo + 1, 0)
+        resp = {"status": "in-progress", "count": _live_total()}
+
+        if layout == "sparse":
+            resp["runs"] = runs
+        else:
+            ordered = []
+            for run in runs:
+                ordered += [""] * (run["start"] - lo - len(ordered))
+                ordered += run["instructions"]
+            ordered += [""] * (size - len(ordered))
+            resp["instructions"] = ordered
+
+        if missing_mode == "ranges":
+            resp["missing_ranges"] = missing_ranges
+        else:
+            resp["missing"] = [i for start, stop in missing_ranges for i in range(start, stop + 1)]
+        resp["missing_count"] = missing_count
+        if concat:
+            # The contiguous prefix comes from the store's message index; only
+            # steps past the watermark are joined here
+            upto = min(store.prefix.steps, end)
+            tail = "".join(v for run in runs for v in run["instructions"][max(upto + 1 - run["start"], 0):])
+            resp["message"] = store.prefix.steps_text(lo, upto) + tail
+        if windowed:
+            resp["from"] = lo
+            resp["to"] = end
+            resp["next_from"] = end + 1 if end < store.max_key else None
+            resp["window_count"] = size - missing_count
+        resp = jsonify(resp)
+    resp.set_etag(etag)
+    return resp, 200
+
+def _final_window(lo: int, hi, concat: bool):
+    """One page of the frozen run; must be called with store_lock held."""
+    etag = _final_etag()
+    if etag in request.if_none_match:
+        return _not_modified(etag)
+
+    total = store.final_count
+    end = total if hi is None else min(hi, total)
+    page = store.final_instructions[lo - 1:end]
+    resp = {
+        "instructions": page,
+        "status": "final",
+        "count": total,
+        "finalization": store.final_summary,
+        "from": lo,
+        "to": end,
+        "next_from": end + 1 if end < total else None,
+        "window_count": len(page),
+    }
+    if concat:
+        resp["message"] = "".join(page)
+    resp = jsonify(resp)
+    resp.set_etag(etag)
+    return resp
+
+class _StreamedArray:
+    """JSON array emitted from an iterator of lists (see _json_chunks)."""
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+class _StreamedString:
+    """JSON string emitted from an iterator of str pieces (see _json_chunks)."""
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+_stream_encoder = json.JSONEncoder(separators=(",", ":"), sort_keys=True)
+
+def _json_chunks(doc: dict):
+    """Serialize `doc` like jsonify, expanding streamed values lazily."""
+    encode = _stream_encoder.encode
+    yield "{"
+    for n, key in enumerate(sorted(doc)):
+        value = doc[key]
+        yield ("," if n else "") + encode(key) + ":"
+        if isinstance(value, _StreamedArray):
+            yield "["
+            first = True
+            for items in value.chunks:
+                if items:
+                    yield ("" if first else ",") + encode(items)[1:-1]
+                    first = False
+            yield "]"
+        elif isinstance(value, _StreamedString):
+            yield '"'
+            for piece in value.chunks:
+                yield encode(piece)[1:-1]
+            yield '"'
+        else:
+            yield encode(value)
+    yield "}\n"
+
+def _windows(lo: int, end: int):
+    for start in range(lo, end + 1, STREAM_RESPONSE_CHUNK):
+        yield start, min(start + STREAM_RESPONSE_CHUNK - 1, end)
+
+def _stream_final(lo: int, hi, concat: bool, windowed: bool):
+    """Stream the frozen run; it never changes, so no lock is held while sending."""
+    # The whole run carries the same ETag as its buffered variant
+    etag = _final_etag("instructions" if windowed or not concat else "instructions+concat")
+    if etag in request.if_none_match:
+        return _not_modified(etag)
+
+    doc = _final_doc(store.final_instructions, store.final_summary, lo, hi, concat, windowed)
+    resp = app.response_class(_json_chunks(doc), mimetype="application/json")
+    resp.set_etag(etag)
+    return resp
+
+def _final_doc(frozen, summary: dict, lo: int, hi, concat: bool, windowed: bool) -> dict:
+    """Document for steps lo..hi of a frozen run, read lazily (see _json_chunks)."""
+    total = len(frozen)
+    end = total if hi is None else min(hi, total)
+    doc = {
+        "instructions": _StreamedArray(frozen[a - 1:b] for a, b in _windows(lo, end)),
+        "status": "final",
+        "count": total,
+        "finalization": summary,
+    }
+    if concat:
+        doc["message"] = _StreamedString("".join(frozen[a - 1:b]) for a, b in _windows(lo, end))
+    if windowed:
+        doc.update({"from": lo, "to": end, "next_from": end + 1 if end < total else None,
+                    "window_count": max(end - lo + 1, 0)})
+    return doc
+
+def _stream_live(lo: int, hi, concat: bool, missing_mode: str, windowed: bool, etag: str):
+    """
+    Stream the in-progress view. Counts and gap intervals are captured now
+    (store_lock is held by the caller); instructions are read later, taking
+    store_lock once per STREAM_RESPONSE_CHUNK steps.
+    """
+    end = store.max_key if hi is None else min(hi, store.max_key)
+    missing_ranges = store.gap_ranges(end, lo)
+    missing_count = sum(stop - start + 1 for start, stop in missing_ranges)
+
+    def instructions():
+        for a, b in _windows(lo, end):
+            with store_lock:
+                chunk = store.get_range(a, b)
+            yield chunk
+
+    doc = {
+        "instructions": _StreamedArray(instructions()),
+        "status": "in-progress",
+        "count": _live_total(),
+        "missing_count": missing_count,
+    }
+    if missing_mode == "ranges":
+        doc["missing_ranges"] = missing_ranges
+    else:
+        doc["missing"] = _StreamedArray(
+            list(range(a, b + 1)) for start, stop in missing_ranges for a, b in _windows(start, stop)
+        )
+    if concat:
+        doc["message"] = _StreamedString("".join(chunk) for chunk in instructions())
+    if windowed:
+        doc.update({"from": lo, "to": end, "next_from": end + 1 if end < store.max_key else None,
+                    "window_count": max(end - lo + 1, 0) - missing_count})
+    resp = app.response_class(_json_chunks(doc), mimetype="application/json")
+    resp.set_etag(etag)
+    return resp
+
+def _message_view() -> tuple:
+    """
+    (index, steps) for the message clients can address by offset: the frozen
+    run once finalized, else the contiguous prefix 1..watermark. The index is
+    the store's MessageIndex or, for a mapped run, the FrozenRun itself.
+    Must be called with store_lock held.
+    """
+    if store.finalized:
+        if isinstance(store.final_instructions, FrozenRun):
+            # Frozen elsewhere: the mapped file carries its own char offsets
+            return store.final_instructions, store.final_count
+        return store.prefix, store.final_count
+    return store.prefix, store.prefix.steps
+
+@app.route("/message", methods=["GET"])
+def message_slice():
+    """
+    Characters offset..offset+length-1 of the message and the seqs covering
+    them, in O(log n + length) via the prefix sums of instruction lengths.
+    Before finalization only the contiguous prefix (1..watermark) is addressable.
+    Query params: offset (default 0), length (default: to the end).
+    """
+    try:
+        offset = int(request.args.get("offset", "0"))
+        length = int(request.args["length"]) if "length" in request.args else None
+    except ValueError:
+        return jsonify({"error": "offset and length must be integers"}), 400
+    if offset < 0 or (length is not None and length < 0):
+        return jsonify({"error": "offset and length must be non-negative"}), 400
 
     with store_lock:
-        if finalized:
-            resp = {
-                "instructions": final_instructions,
-                "status": "final",
-                "count": final_count
-            }
-            if concat:
-                resp["message"] = "".join(final_instructions)
-            return jsonify(resp), 200
-
-        if not seq_to_instr:
-            return jsonify({"instructions": [], "status": "in-progress", "count": 0}), 200
-
-        end = max(seq_to_instr.keys())
-        ordered = [seq_to_instr.get(i, "") for i in range(1, end + 1)]
-        missing = [i for i, v in enumerate(ordered, start=1) if v == ""]
+        _adopt_frozen_run()
+        index, steps = _message_view()
+        total = index.offsets[steps]
+        stop = total if length is None else min(offset + length, total)
+        text = index.substring(offset, stop)
         resp = {
-            "instructions": ordered,
-            "status": "in-progress",
-            "count": sum(1 for v in ordered if v != ""),
-            "missing": missing,
-            "missing_count": len(missing),
+            "status": "final" if store.finalized else "in-progress",
+            "message_length": total,
+            "offset": offset,
+            "length": len(text),
+            "text": text,
+            "first_seq": index.step_at(offset) if text else None,
+            "last_seq": index.step_at(stop - 1) if text else None,
         }
-        if concat:
-            resp["message"] = "".join(ordered)
-        return jsonify(resp), 200
+    return jsonify(resp), 200
+
+# Encoded message for /message/raw, reused while its ETag is current; it is
+# stored under store_lock only if still current and cleared on reset
+_raw_message_cache = {"etag": None, "body": b""}
+
+def _message_etag() -> str:
+    """ETag of the message views; must be called with store_lock held."""
+    return _final_etag() if store.finalized else _live_etag()
+
+@app.route("/message/raw", methods=["GET"])
+def message_raw():
+    """
+    The message as text/plain UTF-8 with single byte-range support
+    (Range: bytes=a-b -> 206). A frozen run on disk is sliced straight from
+    its mmap; otherwise the chunk references are taken under store_lock and
+    encoded after it is released, then cached per ETag.
+    """
+    pieces = None
+    with store_lock:
+        _adopt_frozen_run()
+        etag = _message_etag()
+        if etag in request.if_none_match:
+            return _not_modified(etag)
+
+        frozen = store.final_instructions
+        if isinstance(frozen, FrozenRun):
+            body = frozen.message_bytes()
+        elif _raw_message_cache["etag"] == etag:
+            body = _raw_message_cache["body"]
+        else:
+            index, steps = _message_view()
+            pieces = index.pieces(index.offsets[steps])
+
+    if pieces is not None:
+        body = "".join(pieces).encode("utf-8")
+        with store_lock:
+            if _message_etag() == etag:
+                _raw_message_cache.update(etag=etag, body=body)
+
+    total = len(body)
+    status = 200
+    rng = request.range
+    content_range = None
+    if rng is not None and len(rng.ranges) == 1:
+        bounds = rng.range_for_length(total)
+        if bounds is None:
+            resp = app.response_class(status=416)
+            resp.headers["Content-Range"] = f"bytes */{total}"
+            return resp
+        start, stop = bounds
+        body = body[start:stop]
+        content_range = f"bytes {start}-{stop - 1}/{total}"
+        status = 206
+
+    resp = app.response_class(bytes(body), status=status, mimetype="text/plain")
+    resp.headers["Accept-Ranges"] = "bytes"
+    if content_range:
+        resp.headers["Content-Range"] = content_range
+    resp.set_etag(etag)
+    return resp
+
+@app.route("/analysis", methods=["GET"])
+def analysis_status():
+    """
+    Freeze-time message statistics: "pending" while analysis_pool works on the
+    frozen run, then "ready" with the full finalize summary, or "failed" with
+    the error if the analysis raised.
+    """
+    with store_lock:
+        _adopt_frozen_run()
+        cache = period_cache.stats()
+        if not store.finalized:
+            return jsonify({"analysis": "not_finalized", "period_cache": cache}), 200
+        summary = store.final_summary
+        state = summary.get("analysis", "ready")
+        if state == "pending":
+            return jsonify({"analysis": "pending", "final_seq": summary["final_seq"], "period_cache": cache}), 202
+        return jsonify(dict(summary, analysis=state, period_cache=cache)), 200
+
+@app.route("/analysis/period", methods=["GET"])
+def analysis_period():
+    """
+    Repeating unit of the finalized run (unit text or seq span, repeat count,
+    perfect-power flag), serialized once when the freeze analysis completes.
+    """
+    with store_lock:
+        _adopt_frozen_run()
+        if not store.finalized:
+            early = _early_period()
+            if early is None:
+                return jsonify({"error": "run is not finalized"}), 409
+            # Provisional until the freeze analysis replaces it
+            return jsonify(dict(early, analysis="provisional")), 202
+        if store.final_summary.get("analysis") == "failed":
+            return jsonify({"error": "freeze-time analysis failed",
+                            "analysis": store.final_summary}), 500
+        if "period" not in final_responses:
+            # Still being computed or serialized on analysis_pool
+            return jsonify({"analysis": "pending", "final_seq": store.final_summary["final_seq"]}), 202
+        return _final_response("period")
 
 # Optional: explicit reset to start a brand-new run
 @app.route("/reset", methods=["POST"])
 def reset():
-    global seq_to_instr, final_instructions, final_count, finalized
+    global analysis_generation
     with store_lock:
-        seq_to_instr = {}
-        final_instructions = None
-        final_count = None
-        finalized = False
+        analysis_generation += 1
+        # A FrozenRun may still back a streaming download, so its mapping is
+        # left for garbage collection rather than closed here
+        if FROZEN_RUN_PATH and os.path.exists(FROZEN_RUN_PATH):
+            os.remove(FROZEN_RUN_PATH)
+        store.reset()
+        final_responses.clear()
+        _raw_message_cache.update(etag=None, body=b"")
+        ticket = store.commit_point()
+    store.wait_committed(ticket)
     return jsonify({"status": "reset"}), 200
 
 from flask import request, jsonify
@@ -226,5 +1089,13 @@ def chunks():
 
 
 
+with store_lock:
+    _adopt_frozen_run()
+    # A run recovered by a durable store: finish its analysis if the process
+    # that froze it stopped first, and publish its responses
+    if store.finalized and not analysis_generation:
+        _start_analysis()
+    _resume_early_period()
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8080)
@@ -0,0 +1,52 @@
+"""
+Scaling of period.parallel_unit_length() from 1 to N worker processes.
+
+Correctness is covered by tests/test_period.py; this only times messages of
+about M million characters, with a length that has many divisors.
+"near-miss" is the worst case: every candidate matches until its last
+character, so each one costs a full comparison. "periodic" has a short unit
+that the smallest candidates confirm, so the pool is pure overhead.
+
+Workers = 1 is the serial divisor_unit_length(). Every timing includes pool
+start-up and the shared-memory copy. The pool forks where the platform
+allows it and spawns otherwise.
+
+Usage: python benchmarks/parallel_period.py [M] [max workers]
+       (defaults: 100 and os.cpu_count())
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from period import divisors, parallel_unit_length
+
+
+def composite_length(target: int) -> int:
+    """A length close to target with many divisors (multiple of 2^4*3^2*5*7)."""
+    step = 16 * 9 * 5 * 7
+    return max(target // step, 1) * step
+
+
+def main(million_chars: int, max_workers: int) -> None:
+    n = composite_length(million_chars * 1_000_000)
+    inputs = {
+        "near-miss": "a" * (n - 1) + "b",
+        "periodic": ("LRUDFBL" * (n // 7 + 1))[:n],
+    }
+    print(f"{n} chars, {len(divisors(n))} divisors")
+    print(f"{'input':<10} {'workers':>7} {'s':>8} {'speedup':>8}")
+    for label, s in inputs.items():
+        base = None
+        for workers in range(1, max_workers + 1):
+            start = time.perf_counter()
+            parallel_unit_length(s, workers=workers, min_chars=0)
+            elapsed = time.perf_counter() - start
+            base = base or elapsed
+            print(f"{label:<10} {workers:>7} {elapsed:>8.3f} {base / elapsed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    main(args[0] if args else 100, args[1] if len(args) > 1 else os.cpu_count() or 1)
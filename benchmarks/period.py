@@ -0,0 +1,78 @@
+"""
+Freeze-time period detection benchmark.
+
+Correctness is covered by tests/test_period.py; this only times.
+
+1. Character-level variants timed on messages of L characters.
+2. Long, highly repetitive runs (a unit of U instructions repeated until N
+   steps): the character-level KMP pass over the joined message against the
+   instruction-level detector that only confirms characters inside one unit.
+
+Usage: python benchmarks/period.py [N ...]    (default: 100000 1000000)
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from period import PERIOD_ALGORITHMS, message_period, repeating_unit_length
+
+
+def fibonacci_word(n: int) -> str:
+    a, b = "a", "ab"
+    while len(b) < n:
+        a, b = b, b + a
+    return b[:n]
+
+
+def make_run(n: int, unit_steps: int, width: int = 12) -> list:
+    rng = random.Random(n * 31 + unit_steps)
+    unit = ["".join(rng.choice("LRUDFB") for _ in range(width)) for _ in range(unit_steps)]
+    return (unit * (n // unit_steps + 1))[:n - n % unit_steps]
+
+
+def timed(fn, *args) -> tuple:
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def bench_variants(length: int) -> None:
+    inputs = {
+        "periodic": ("LRUDFBLRUD" * (length // 10 + 1))[:length - length % 10],
+        "aperiodic": fibonacci_word(length),
+        "near-miss": "a" * (length - 1) + "b",
+    }
+    names = list(PERIOD_ALGORITHMS)
+    print(f"{'chars':>9} {'input':<10} " + " ".join(f"{n + ' s':>14}" for n in names))
+    for label, s in inputs.items():
+        row = []
+        for name in names:
+            elapsed, _ = timed(PERIOD_ALGORITHMS[name], s)
+            row.append(f"{elapsed:>14.3f}")
+        print(f"{len(s):>9} {label:<10} " + " ".join(row))
+
+
+def bench_instruction_level(n: int) -> None:
+    for unit_steps in (7, 1000):
+        run = make_run(n, unit_steps)
+        message = "".join(run)
+        kmp_s, chars = timed(repeating_unit_length, message)
+        instr_s, (steps, unit_chars) = timed(message_period, run)
+        assert unit_chars == chars, (unit_chars, chars)
+        print(f"{len(run):>9} {steps:>6} {len(message):>11} {kmp_s:>8.3f} {instr_s:>8.3f} "
+              f"{kmp_s / instr_s:>7.1f}x")
+
+
+def main(sizes) -> None:
+    for n in sizes:
+        bench_variants(n)
+    print(f"\n{'steps':>9} {'unit':>6} {'chars':>11} {'kmp s':>8} {'instr s':>8} {'speedup':>8}")
+    for n in sizes:
+        bench_instruction_level(n)
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [100_000, 1_000_000])
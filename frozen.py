@@ -0,0 +1,136 @@
+"""
+On-disk form of a finalized run, served through mmap.
+
+Once a run is frozen its instructions never change, so they are written once
+to a compact file and every reader (this process after a restart, or sibling
+worker processes) maps it instead of holding its own list of str:
+
+    FROZEN_MAGIC
+    JSON header line, space-padded to a multiple of 8 bytes
+    int64 byte offsets, count + 1 entries (instruction i is blob[off[i]:off[i+1]])
+    int64 character offsets, count + 1 entries (the message's prefix sums)
+    UTF-8 blob of all instructions concatenated (i.e. the message)
+
+The character offsets let a mapped run answer message offset lookups
+(substring, step_at) like message.MessageIndex, without building one.
+"""
+from array import array
+from bisect import bisect_right
+from collections.abc import Sequence
+import hashlib
+import json
+import mmap
+import os
+
+FROZEN_MAGIC = b"IFRZ2\n"
+
+
+class FrozenRun(Sequence):
+    """Read-only, mmap-backed list of the frozen instructions."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        if view[:len(FROZEN_MAGIC)] != FROZEN_MAGIC:
+            raise ValueError(f"{path} is not a frozen run file")
+
+        header_end = self._map.find(b"\n", len(FROZEN_MAGIC)) + 1
+        header = json.loads(bytes(view[len(FROZEN_MAGIC):header_end]))
+        self.count = header["count"]
+        self.final_seq = header["final_seq"]
+        self.summary = header["summary"]
+
+        table = 8 * (self.count + 1)
+        self._offsets = view[header_end:header_end + table].cast("q")
+        self.offsets = view[header_end + table:header_end + 2 * table].cast("q")
+        self._blob = view[header_end + 2 * table:]
+
+    @staticmethod
+    def write(path: str, final_seq: int, instructions, summary: dict) -> None:
+        """Write a frozen run atomically (tmp file + rename)."""
+        encoded = [s.encode("utf-8") for s in instructions]
+        offsets = array("q", [0])
+        char_offsets = array("q", [0])
+        total = chars = 0
+        for s, b in zip(instructions, encoded):
+            total += len(b)
+            chars += len(s)
+            offsets.append(total)
+            char_offsets.append(chars)
+
+        header = json.dumps({"count": len(encoded), "final_seq": final_seq, "summary": summary}).encode("utf-8")
+        # Pad so the offsets table starts 8-byte aligned
+        pad = -(len(FROZEN_MAGIC) + len(header) + 1) % 8
+        with open(path + ".tmp", "wb") as f:
+            f.write(FROZEN_MAGIC)
+            f.write(header + b" " * pad + b"\n")
+            offsets.tofile(f)
+            char_offsets.tofile(f)
+            for b in encoded:
+                f.write(b)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self.count)
+            if step != 1:
+                return [self[j] for j in range(start, stop, step)]
+            if start >= stop:
+                return []
+            # One decode for the whole slice, split on the char offsets
+            text = str(self._blob[self._offsets[start]:self._offsets[stop]], "utf-8")
+            offsets, base = self.offsets, self.offsets[start]
+            return [text[offsets[j] - base:offsets[j + 1] - base] for j in range(start, stop)]
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("frozen run index out of range")
+        return str(self._blob[self._offsets[i]:self._offsets[i + 1]], "utf-8")
+
+    def tolist(self) -> list:
+        """All instructions, decoding the blob once and slicing the result."""
+        offsets = self.offsets
+        text = self.message()
+        return [text[offsets[i]:offsets[i + 1]] for i in range(self.count)]
+
+    def substring(self, start: int, stop: int) -> str:
+        """Characters start..stop-1 of the message, decoding only the covering steps."""
+        start, stop = max(start, 0), min(stop, self.offsets[self.count])
+        if start >= stop:
+            return ""
+        first = self.step_at(start) - 1
+        last = self.step_at(stop - 1) - 1
+        text = str(self._blob[self._offsets[first]:self._offsets[last + 1]], "utf-8")
+        base = self.offsets[first]
+        return text[start - base:stop - base]
+
+    def step_at(self, offset: int) -> int:
+        """1-based step containing character `offset` (binary search on offsets)."""
+        return bisect_right(self.offsets, offset)
+
+    def digest(self, steps: int) -> str:
+        """Same content digest as MessageIndex.digest() for steps 1..steps."""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(self.offsets[:steps + 1])
+        h.update(self._blob[:self._offsets[steps]])
+        return h.hexdigest()
+
+    def message_bytes(self) -> memoryview:
+        """The concatenated message as UTF-8, straight from the mapping."""
+        return self._blob
+
+    def message(self) -> str:
+        return str(self._blob, "utf-8")
+
+    def close(self) -> None:
+        self._offsets.release()
+        self.offsets.release()
+        self._blob.release()
+        self._map.close()
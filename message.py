@@ -0,0 +1,155 @@
+"""
+Incrementally maintained message for the contiguous prefix of a run.
+
+The store feeds each step to MessageIndex as the watermark advances, so the
+concatenated message of steps 1..watermark is never rebuilt from scratch:
+it lives as a list of sealed str chunks (about CHUNK_CHARS each) plus a small
+open tail, and a prefix-sum table of step lengths maps steps to characters.
+Optionally the prefix function of the message is advanced alongside it.
+"""
+from array import array
+from bisect import bisect_right
+import hashlib
+import os
+
+from period import PrefixFunction
+
+CHUNK_CHARS = 64 * 1024
+
+# Opt-in (ONLINE_PERIOD=1): advance the KMP prefix function as the prefix
+# grows, trading ~8 bytes per character and pure-Python work inside every
+# upsert (under store_lock) for a period known at freeze time. The early
+# period report reads it, so EARLY_PERIOD_REPEATS > 0 turns it on too
+ONLINE_PERIOD = (os.environ.get("ONLINE_PERIOD", "0") != "0"
+                 or int(os.environ.get("EARLY_PERIOD_REPEATS", "0")) > 0)
+
+
+class MessageIndex:
+    """Chunked concatenation of steps 1..steps with per-step char offsets."""
+
+    def __init__(self, chunk_chars: int = CHUNK_CHARS, track_period: bool = ONLINE_PERIOD):
+        self.chunk_chars = chunk_chars
+        self.kmp = PrefixFunction() if track_period else None
+        self.chunks = []                # sealed segments of the message
+        self.chunk_starts = array("q")  # char offset of each sealed segment
+        self.sealed_len = 0             # chars held in sealed segments
+        self._tail = []                 # pieces of the open segment
+        self._tail_len = 0
+        self.offsets = array("q", [0])  # step i (1-based) is chars offsets[i-1]:offsets[i]
+
+    @property
+    def steps(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def length(self) -> int:
+        return self.offsets[-1]
+
+    def append(self, instr: str) -> None:
+        self.offsets.append(self.offsets[-1] + len(instr))
+        self._tail.append(instr)
+        self._tail_len += len(instr)
+        if self.kmp is not None:
+            self.kmp.extend(instr)
+        if self._tail_len >= self.chunk_chars:
+            self.chunk_starts.append(self.sealed_len)
+            self.chunks.append("".join(self._tail))
+            self.sealed_len += self._tail_len
+            self._tail = []
+            self._tail_len = 0
+
+    def truncate(self, steps: int) -> None:
+        """Keep only the first `steps` steps (rare: a prefix step was rewritten)."""
+        if steps >= self.steps:
+            return
+        text = self.substring(0, self.offsets[steps])
+        offsets = self.offsets[:steps + 1]
+        kmp = self.kmp
+        self.__init__(self.chunk_chars, track_period=False)
+        self.offsets = offsets
+        self.kmp = kmp
+        if kmp is not None:
+            kmp.truncate(len(text))
+        for start in range(0, len(text), self.chunk_chars):
+            self.chunk_starts.append(start)
+            self.chunks.append(text[start:start + self.chunk_chars])
+        self.sealed_len = len(text)
+
+    def substring(self, start: int, stop: int) -> str:
+        """Characters start..stop-1 of the message, touching only covering chunks."""
+        start, stop = max(start, 0), min(stop, self.length)
+        if start >= stop:
+            return ""
+        pieces = []
+        if start < self.sealed_len:
+            i = bisect_right(self.chunk_starts, start) - 1
+            while i < len(self.chunks) and self.chunk_starts[i] < stop:
+                base = self.chunk_starts[i]
+                pieces.append(self.chunks[i][max(start - base, 0):stop - base])
+                i += 1
+        if stop > self.sealed_len:
+            tail = "".join(self._tail)
+            pieces.append(tail[max(start - self.sealed_len, 0):stop - self.sealed_len])
+        return "".join(pieces)
+
+    def pieces(self, stop: int) -> list:
+        """
+        Sealed chunks (shared, not copied) and tail covering characters
+        0..stop-1: cheap to take under store_lock, joined by the caller later.
+        """
+        stop = min(stop, self.length)
+        out = []
+        for start, chunk in zip(self.chunk_starts, self.chunks):
+            if start >= stop:
+                return out
+            out.append(chunk if start + len(chunk) <= stop else chunk[:stop - start])
+        if stop > self.sealed_len:
+            out.append("".join(self._tail)[:stop - self.sealed_len])
+        return out
+
+    def steps_text(self, first: int, last: int) -> str:
+        """Concatenated instructions of steps first..last (1-based, inclusive)."""
+        first, last = max(first, 1), min(last, self.steps)
+        if first > last:
+            return ""
+        return self.substring(self.offsets[first - 1], self.offsets[last])
+
+    def step_at(self, offset: int) -> int:
+        """1-based step containing character `offset` (binary search on offsets)."""
+        return bisect_right(self.offsets, offset)
+
+    def start_period_tracking(self) -> None:
+        """Advance a new prefix function over the message so far (e.g. after recovery)."""
+        if self.kmp is None:
+            self.kmp = PrefixFunction()
+            for piece in self.pieces(self.length):
+                self.kmp.extend(piece)
+
+    def unit_length(self, chars: int):
+        """Smallest repeating unit of the first `chars` characters, or None if untracked."""
+        if self.kmp is None or len(self.kmp) < chars:
+            return None
+        return self.kmp.unit_length(chars)
+
+    def period(self):
+        """
+        (smallest period, full repeats of it) of the whole prefix, or None if
+        untracked. The period need not divide the length: the prefix is
+        repeats copies of its first `period` characters plus a partial copy.
+        """
+        if self.kmp is None or not self.length:
+            return None
+        period = self.kmp.period(self.length)
+        return period, self.length // period
+
+    def digest(self, steps: int) -> str:
+        """
+        Content digest of steps 1..steps: the message and the step boundaries,
+        hashed one chunk at a time without joining the message.
+        """
+        h = hashlib.blake2b(digest_size=16)
+        h.update(self.offsets[:steps + 1].tobytes())
+        end = self.offsets[steps]
+        for start in range(0, end, self.chunk_chars):
+            h.update(self.substring(start, min(start + self.chunk_chars, end)).encode("utf-8", "surrogatepass"))
+        return h.hexdigest()
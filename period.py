@@ -0,0 +1,350 @@
+"""
+Period detection for run messages.
+
+repeating_unit_length() is the reference: the smallest d dividing len(s) such
+that s is s[:d] repeated, else len(s). The other helpers reach the same answer
+with less work for the shapes runs actually have; PERIOD_ALGORITHMS names the
+interchangeable character-level variants.
+parallel_unit_length() spreads the divisor candidates of very long messages
+across a process pool.
+"""
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+from threading import Lock
+
+try:
+    import numpy
+except ImportError:  # optional: the divisor check falls back to memoryview
+    numpy = None
+
+
+def repeating_unit_length(s: str) -> int:
+    if not s:
+        return 0
+    pi = [0] * len(s)
+    for i in range(1, len(s)):
+        j = pi[i - 1]
+        while j > 0 and s[i] != s[j]:
+            j = pi[j - 1]
+        if s[i] == s[j]:
+            j += 1
+        pi[i] = j
+    n = len(s)
+    period = n - pi[-1]
+    return period if n % period == 0 else n
+
+
+def divisors(n: int) -> list:
+    """Divisors of n in ascending order."""
+    small, large = [], []
+    d = 1
+    while d * d <= n:
+        if n % d == 0:
+            small.append(d)
+            if d * d != n:
+                large.append(n // d)
+        d += 1
+    return small + large[::-1]
+
+
+def smallest_unit(seq) -> int:
+    """
+    Smallest d dividing len(seq) with seq == seq[:d] * (len(seq) // d), checked
+    by comparing seq[d:] with seq[:-d] at each candidate (C-speed slices).
+    """
+    n = len(seq)
+    for d in divisors(n):
+        if d == n or seq[d:] == seq[:-d]:
+            return d
+    return 0
+
+
+def z_unit_length(s: str) -> int:
+    """Z-function variant: the unit is the smallest d | n with z[d] == n - d."""
+    n = len(s)
+    if n == 0:
+        return 0
+    z = [0] * n
+    left = right = 0
+    for i in range(1, n):
+        if i < right:
+            z[i] = min(right - i, z[i - left])
+        while i + z[i] < n and s[z[i]] == s[i + z[i]]:
+            z[i] += 1
+        if i + z[i] > right:
+            left, right = i, i + z[i]
+    for d in divisors(n):
+        if d == n or z[d] == n - d:
+            return d
+    return n
+
+
+def divisor_unit_length(s: str) -> int:
+    """
+    Divisor-of-n candidate check over one fixed-width encoding of s: each
+    candidate d compares the buffer with itself shifted by d characters,
+    using NumPy when available and memoryview comparison (no copies) otherwise.
+    """
+    n = len(s)
+    if n == 0:
+        return 0
+    width = 1 if s.isascii() else 4
+    buf = s.encode("ascii" if width == 1 else "utf-32-le")
+    if numpy is not None:
+        codes = numpy.frombuffer(buf, dtype=numpy.uint8 if width == 1 else numpy.uint32)
+        same = lambda d: numpy.array_equal(codes[d:], codes[:-d])
+    else:
+        view = memoryview(buf)
+        same = lambda d: view[d * width:] == view[:-d * width]
+    for d in divisors(n):
+        if d == n or same(d):
+            return d
+    return n
+
+
+_HASH_MOD = (1 << 61) - 1
+_HASH_BASE = 131
+
+
+def rolling_hash_unit_length(s: str) -> int:
+    """
+    Rolling-hash variant: prefix hashes make "s[d:] == s[:-d]" an O(1) test
+    per divisor candidate; a hash match is confirmed by direct comparison so
+    collisions can never produce a wrong answer.
+    """
+    n = len(s)
+    if n == 0:
+        return 0
+    mod, base = _HASH_MOD, _HASH_BASE
+    prefix = array("Q", [0])
+    power = array("Q", [1])
+    h, p = 0, 1
+    for ch in s:
+        h = (h * base + ord(ch)) % mod
+        p = p * base % mod
+        prefix.append(h)
+        power.append(p)
+
+    def span(lo: int, hi: int) -> int:
+        return (prefix[hi] - prefix[lo] * power[hi - lo]) % mod
+
+    for d in divisors(n):
+        if d == n:
+            return d
+        if span(d, n) == span(0, n - d) and s[d:] == s[:-d]:
+            return d
+    return n
+
+
+# Parallel divisor check: worker processes (PERIOD_WORKERS, default one per
+# core) and the message length below which the serial check is used instead
+PERIOD_WORKERS = int(os.environ.get("PERIOD_WORKERS", "0")) or os.cpu_count() or 1
+PARALLEL_MIN_CHARS = int(os.environ.get("PARALLEL_MIN_CHARS", str(16 * 1024 * 1024)))
+
+# Workers compare this many bytes at a time, re-checking the shared best
+# candidate in between so a confirmed smaller period stops longer checks
+_COMPARE_BLOCK = 4 * 1024 * 1024
+
+_worker = {}
+
+
+def _init_worker(shm_name: str, nbytes: int, width: int, best) -> None:
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker.update(shm=shm, view=shm.buf[:nbytes], width=width, best=best)
+
+
+def _check_candidates(candidates) -> int:
+    """
+    Smallest valid period among `candidates` (ascending), or 0. Candidates at
+    or above the best period confirmed so far by any worker are skipped.
+    """
+    view, width, best = _worker["view"], _worker["width"], _worker["best"]
+    total = len(view)
+    for d in candidates:
+        if d >= best.value:
+            return 0
+        shift = d * width
+        for start in range(0, total - shift, _COMPARE_BLOCK):
+            stop = min(start + _COMPARE_BLOCK, total - shift)
+            if view[shift + start:shift + stop] != view[start:stop]:
+                break
+            if d >= best.value:
+                return 0
+        else:
+            with best.get_lock():
+                if d < best.value:
+                    best.value = d
+            return d
+    return 0
+
+
+def parallel_unit_length(s: str, workers: int = None, min_chars: int = None) -> int:
+    """
+    divisor_unit_length() with the divisors of len(s) dealt round-robin to
+    `workers` processes, each comparing its candidates against one
+    shared-memory copy of the message. Every worker tries its smallest
+    candidates first and publishes a confirmed period, and all of them stop
+    at candidates that can no longer beat it.
+    """
+    workers = PERIOD_WORKERS if workers is None else workers
+    min_chars = PARALLEL_MIN_CHARS if min_chars is None else min_chars
+    n = len(s)
+    if workers <= 1 or n < min_chars:
+        return divisor_unit_length(s)
+
+    width = 1 if s.isascii() else 4
+    buf = s.encode("ascii" if width == 1 else "utf-32-le")
+    candidates = divisors(n)[:-1]
+    if not candidates:
+        return n
+    workers = min(workers, len(candidates))
+
+    # fork where available: spawn and forkserver children re-import the
+    # caller's __main__, and app.py opens its store at import time. In the
+    # service this forks from the analysis thread of a multi-threaded process,
+    # so a child inherits every lock another thread held at that moment, still
+    # held. The children therefore run only _init_worker and _check_candidates,
+    # which touch the shared memory, `best` and the pool's own queues (all
+    # created here, before the fork) and never the store, sqlite, logging
+    # handlers or stdio. Keep it that way.
+    ctx = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn")
+    best = ctx.Value("q", n)
+    shm = shared_memory.SharedMemory(create=True, size=len(buf))
+    try:
+        shm.buf[:len(buf)] = buf
+        del buf
+        with ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(shm.name, n * width, width, best)) as pool:
+            found = [d for d in pool.map(_check_candidates, [candidates[i::workers] for i in range(workers)]) if d]
+    finally:
+        shm.close()
+        shm.unlink()
+    return min(found, default=n)
+
+
+PERIOD_ALGORITHMS = {
+    "kmp": repeating_unit_length,
+    "z": z_unit_length,
+    "divisor": divisor_unit_length,
+    "rolling-hash": rolling_hash_unit_length,
+    "parallel": parallel_unit_length,
+}
+
+
+def get_period_algorithm(name: str):
+    try:
+        return PERIOD_ALGORITHMS[name]
+    except KeyError:
+        raise ValueError(f"unknown period algorithm {name!r}; choose from {sorted(PERIOD_ALGORITHMS)}") from None
+
+
+def instruction_period(instructions) -> int:
+    """
+    Repeating unit of a run measured in instructions: each instruction is
+    interned to a small integer id and the id sequence is checked instead of
+    the characters, so cost follows the number of steps, not message length.
+    """
+    ids = {}
+    seq = [ids.setdefault(instr, len(ids)) for instr in instructions]
+    return smallest_unit(seq)
+
+
+def message_period(instructions, unit_length=divisor_unit_length) -> tuple:
+    """
+    (unit in instructions, unit in characters). The message is the
+    instruction-level unit repeated, so its character unit divides that
+    unit's text and is confirmed there only, with `unit_length`.
+    """
+    steps = instruction_period(instructions)
+    return steps, unit_length("".join(instructions[:steps]))
+
+
+class PeriodCache:
+    """
+    Bounded LRU of period results keyed by a content digest, so a run
+    re-ingested after /reset gets its period back without recomputing it.
+    maxsize 0 disables caching.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "size": len(self._entries), "maxsize": self.maxsize}
+
+
+class PrefixFunction:
+    """
+    KMP prefix function extended one piece of text at a time, so the smallest
+    period of a growing message is known without a full pass at the end.
+    Holds the message as code points plus pi, about 8 bytes per character.
+    """
+
+    def __init__(self):
+        self.codes = array("I")
+        self.pi = array("i")
+
+    def __len__(self) -> int:
+        return len(self.pi)
+
+    def extend(self, text: str) -> None:
+        codes, pi = self.codes, self.pi
+        start = len(codes)
+        codes.extend(map(ord, text))
+        for i in range(start, len(codes)):
+            if i == 0:
+                pi.append(0)
+                continue
+            c = codes[i]
+            j = pi[i - 1]
+            while j > 0 and c != codes[j]:
+                j = pi[j - 1]
+            if c == codes[j]:
+                j += 1
+            pi.append(j)
+
+    def truncate(self, n: int) -> None:
+        """Forget everything after the first n characters (pi stays valid)."""
+        del self.codes[n:]
+        del self.pi[n:]
+
+    def period(self, n: int = None) -> int:
+        """Smallest period of the first n characters (need not divide n)."""
+        n = len(self.pi) if n is None else n
+        return n - self.pi[n - 1] if n else 0
+
+    def unit_length(self, n: int = None) -> int:
+        """repeating_unit_length() of the first n characters (default: all)."""
+        n = len(self.pi) if n is None else n
+        if n == 0:
+            return 0
+        period = self.period(n)
+        return period if n % period == 0 else n
@@ -0,0 +1,781 @@
+"""
+Instruction stores behind the /instruction API.
+
+A store owns one run: the live seq -> instruction map, the incremental
+completeness tracking (contiguous watermark plus gap intervals), the pending
+terminator and the frozen result. Stores are not thread-safe; app.py
+serializes every call with store_lock.
+
+Backends are picked by name through make_store(), so alternatives can be
+swapped in by configuration and compared on the same workloads.
+"""
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_right, insort
+from itertools import accumulate
+from threading import Condition, Thread
+import atexit
+import json
+import os
+import sqlite3
+import struct
+import time
+import uuid
+
+from message import ONLINE_PERIOD, MessageIndex
+
+# Durable stores: SQLite database path and how long the writer waits to gather a group
+# of upserts into one transaction (one WAL fsync per group, not per step).
+SQLITE_PATH = os.environ.get("INSTRUCTION_DB", "instructions.db")
+GROUP_COMMIT_MS = float(os.environ.get("GROUP_COMMIT_MS", "2"))
+
+# Log store: directory for log segments and snapshots, and how many upserts
+# accumulate before the store is snapshotted and older segments dropped.
+LOG_DIR = os.environ.get("INSTRUCTION_LOG_DIR", "instruction_log")
+SNAPSHOT_EVERY = int(os.environ.get("SNAPSHOT_EVERY", "1000000"))
+
+
+class FrozenSteps:
+    """
+    Steps 1..count of a frozen run, read straight from its live map: freezing
+    only records this view, and the analysis worker replaces it with a list
+    (or a FrozenRun) built off store_lock. Indexes are 0-based like a list.
+    The map no longer changes once the run is frozen; reset swaps in a new one.
+    """
+
+    def __init__(self, seq_to_instr: dict, count: int):
+        self._steps = seq_to_instr
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            steps = self._steps
+            return [steps[k + 1] for k in range(*i.indices(self._count))]
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError("frozen step index out of range")
+        return self._steps[i + 1]
+
+    def __iter__(self):
+        steps = self._steps
+        return (steps[k] for k in range(1, self._count + 1))
+
+    def __eq__(self, other):
+        if isinstance(other, FrozenSteps):
+            return self._count == other._count and list(self) == list(other)
+        return NotImplemented
+
+
+class InstructionStore(ABC):
+    """
+    Interface implemented by every backend; a backend missing one of the
+    abstract methods fails when it is created, not on first use.
+
+    Besides the methods below, a store exposes these read-only attributes:
+      - live_count: number of non-empty steps stored (any seq)
+      - max_key: highest seq stored, terminators included
+      - max_seq: highest seq >= 1 holding a non-empty step
+      - gap_total: number of missing seqs in 1..max_seq
+      - pending_final_seq: terminator waiting for the run to complete, or None
+      - finalized / final_instructions / final_count / final_summary
+      - prefix: MessageIndex of the contiguous steps 1..watermark()
+      - version: bumped on every change to the run, never decreases; with
+        `epoch` (unique per process) it identifies a view for ETags
+    """
+
+    # Live accumulation
+    @abstractmethod
+    def upsert(self, seq: int, instr: str) -> None:
+        ...
+
+    @abstractmethod
+    def get_range(self, start: int, end: int) -> list:
+        """Instructions for seqs start..end inclusive, "" where missing."""
+
+    @abstractmethod
+    def is_empty(self) -> bool:
+        ...
+
+    # Completeness
+    @abstractmethod
+    def watermark(self) -> int:
+        ...
+
+    @abstractmethod
+    def gap_ranges(self, limit: int, start: int = 1) -> list:
+        ...
+
+    @abstractmethod
+    def present_runs(self, limit: int, start: int = 1) -> list:
+        ...
+
+    @abstractmethod
+    def missing_before(self, final_seq: int) -> int:
+        ...
+
+    @abstractmethod
+    def first_missing_before(self, final_seq: int, n: int) -> list:
+        ...
+
+    # Lifecycle
+    @abstractmethod
+    def set_pending(self, final_seq: int) -> None:
+        ...
+
+    @abstractmethod
+    def freeze(self, final_seq: int) -> None:
+        """Freeze steps 1..(final_seq-1) permanently, without copying them."""
+
+    @abstractmethod
+    def record_summary(self, summary: dict) -> None:
+        ...
+
+    @abstractmethod
+    def adopt_frozen(self, final_seq: int, instructions, summary: dict) -> None:
+        """Serve an already-frozen run (e.g. a FrozenRun) without re-ingesting it."""
+
+    @abstractmethod
+    def reset(self) -> None:
+        ...
+
+    # Durability
+    def commit_point(self) -> int:
+        """Ticket covering every write made so far (call with store_lock held)."""
+        return 0
+
+    def wait_committed(self, ticket: int) -> None:
+        """Block until writes up to `ticket` are durable (call without store_lock)."""
+
+
+class MemoryStore(InstructionStore):
+    """
+    Default in-process store: a plain dict plus sorted gap intervals.
+    Missing seqs below max_seq are kept as disjoint [start, end] gaps so
+    completeness questions never rescan the dict.
+    """
+
+    epoch = uuid.uuid4().hex[:12]
+    version = 0
+    # Set while a durable store rebuilds itself; the prefix function is not
+    # replayed then (the freeze analysis falls back to a character-level pass)
+    _recovering = False
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.version += 1
+        self.seq_to_instr = {}
+        self.live_count = 0
+        self.max_key = 0
+        self.prefix = MessageIndex(track_period=ONLINE_PERIOD and not self._recovering)
+
+        self.max_seq = 0
+        self.gap_starts = []        # sorted gap starts
+        self.gap_ends = {}          # gap start -> inclusive gap end
+        self.gap_total = 0
+
+        self.pending_final_seq = None
+        self.final_instructions = None
+        self.final_count = None
+        self.finalized = False
+        self.final_summary = None
+
+    # ---- live accumulation ----
+
+    def upsert(self, seq: int, instr: str) -> None:
+        self.version += 1
+        old = self.seq_to_instr.get(seq, "")
+        self.seq_to_instr[seq] = instr
+        if seq > self.max_key:
+            self.max_key = seq
+        if old == "" and instr != "":
+            self.live_count += 1
+            if seq >= 1:
+                self._mark_present(seq)
+        elif old != "" and instr == "":
+            self.live_count -= 1
+            if seq >= 1:
+                self._mark_missing(seq)
+        if seq == self.pending_final_seq and instr != "":
+            # The terminator was overwritten by a real step: no longer pending
+            self.pending_final_seq = None
+        if 1 <= seq <= self.prefix.steps and instr != old:
+            self.prefix.truncate(seq - 1)
+        self._extend_prefix()
+
+    def _extend_prefix(self) -> None:
+        """Feed newly contiguous steps to the prefix message index."""
+        prefix, target = self.prefix, self.watermark()
+        while prefix.steps < target:
+            prefix.append(self.seq_to_instr[prefix.steps + 1])
+
+    def get_range(self, start: int, end: int) -> list:
+        get = self.seq_to_instr.get
+        return [get(i, "") for i in range(start, end + 1)]
+
+    def is_empty(self) -> bool:
+        return not self.seq_to_instr
+
+    def _mark_present(self, seq: int) -> None:
+        if seq > self.max_seq:
+            if seq > self.max_seq + 1:
+                insort(self.gap_starts, self.max_seq + 1)
+                self.gap_ends[self.max_seq + 1] = seq - 1
+                self.gap_total += seq - 1 - self.max_seq
+            self.max_seq = seq
+            return
+
+        i = bisect_right(self.gap_starts, seq) - 1
+        start = self.gap_starts[i]
+        end = self.gap_ends.pop(start)
+        del self.gap_starts[i]
+        if seq + 1 <= end:
+            self.gap_starts.insert(i, seq + 1)
+            self.gap_ends[seq + 1] = end
+        if start <= seq - 1:
+            self.gap_starts.insert(i, start)
+            self.gap_ends[start] = seq - 1
+        self.gap_total -= 1
+
+    def _mark_missing(self, seq: int) -> None:
+        starts, ends = self.gap_starts, self.gap_ends
+        i = bisect_right(starts, seq)
+        left = starts[i - 1] if i > 0 and ends[starts[i - 1]] == seq - 1 else None
+
+        if seq == self.max_seq:
+            # Dropping the last step pulls max_seq back past any trailing gap.
+            if left is not None:
+                self.gap_total -= seq - left
+                del starts[i - 1]
+                del ends[left]
+                self.max_seq = left - 1
+            else:
+                self.max_seq = seq - 1
+            return
+
+        start, end = seq, seq
+        if i < len(starts) and starts[i] == seq + 1:
+            end = ends.pop(starts.pop(i))
+        if left is not None:
+            start = left
+            del starts[i - 1]
+            del ends[left]
+        insort(starts, start)
+        ends[start] = end
+        self.gap_total += 1
+
+    # ---- completeness ----
+
+    def watermark(self) -> int:
+        """Highest k such that steps 1..k are all present."""
+        return self.gap_starts[0] - 1 if self.gap_starts else self.max_seq
+
+    def missing_before(self, final_seq: int) -> int:
+        """Number of missing steps in 1..(final_seq-1)."""
+        limit = final_seq - 1
+        if limit >= self.max_seq:
+            return self.gap_total + limit - self.max_seq
+        total = 0
+        for start in self.gap_starts:
+            if start > limit:
+                break
+            total += min(self.gap_ends[start], limit) - start + 1
+        return total
+
+    def _first_gap_from(self, start: int) -> int:
+        """Index of the first gap that ends at or after `start`."""
+        i = bisect_right(self.gap_starts, start) - 1
+        if i < 0 or self.gap_ends[self.gap_starts[i]] < start:
+            i += 1
+        return i
+
+    def gap_ranges(self, limit: int, start: int = 1) -> list:
+        """Missing steps in start..limit as [start, end] intervals, one per gap."""
+        out = []
+        if start > limit:
+            return out
+        starts = self.gap_starts
+        for i in range(self._first_gap_from(start), len(starts)):
+            if starts[i] > limit:
+                return out
+            out.append([max(starts[i], start), min(self.gap_ends[starts[i]], limit)])
+        if limit > self.max_seq and limit >= start:
+            out.append([max(self.max_seq + 1, start), limit])
+        return out
+
+    def present_runs(self, limit: int, start: int = 1) -> list:
+        """Present steps in start..limit as (start, end) runs, the complement of the gaps."""
+        out = []
+        pos = start
+        stop = min(limit, self.max_seq)
+        starts = self.gap_starts
+        for i in range(self._first_gap_from(start), len(starts)):
+            if starts[i] > stop:
+                break
+            if pos < starts[i]:
+                out.append((pos, starts[i] - 1))
+            pos = self.gap_ends[starts[i]] + 1
+        if pos <= stop:
+            out.append((pos, stop))
+        return out
+
+    def first_missing_before(self, final_seq: int, n: int) -> list:
+        """First n missing steps in 1..(final_seq-1), walking gaps rather than seqs."""
+        limit = final_seq - 1
+        out = []
+        for start in self.gap_starts:
+            if start > limit or len(out) >= n:
+                return out
+            stop = min(self.gap_ends[start], limit, start + n - len(out) - 1)
+            out.extend(range(start, stop + 1))
+        if limit > self.max_seq and len(out) < n:
+            out.extend(range(self.max_seq + 1, min(limit, self.max_seq + n - len(out)) + 1))
+        return out
+
+    # ---- lifecycle ----
+
+    def set_pending(self, final_seq: int) -> None:
+        self.version += 1
+        self.pending_final_seq = final_seq
+
+    def freeze(self, final_seq: int) -> None:
+        self.version += 1
+        self.final_count = max(final_seq - 1, 0)
+        self.final_instructions = FrozenSteps(self.seq_to_instr, self.final_count)
+        self.finalized = True
+
+    def record_summary(self, summary: dict) -> None:
+        self.version += 1
+        self.final_summary = summary
+
+    def adopt_frozen(self, final_seq: int, instructions, summary: dict) -> None:
+        self.version += 1
+        self.pending_final_seq = final_seq
+        self.final_instructions = instructions
+        self.final_count = len(instructions)
+        self.finalized = True
+        self.final_summary = summary
+
+    # ---- bulk loading (recovery) ----
+
+    def _load(self, seq_to_instr: dict) -> None:
+        """Replace the live map wholesale and rebuild every index in one pass."""
+        MemoryStore.reset(self)
+        self.seq_to_instr = seq_to_instr
+        if not seq_to_instr:
+            return
+        self.max_key = max(max(seq_to_instr), 0)
+        present = sorted(s for s, v in seq_to_instr.items() if v != "" and s >= 1)
+        self.live_count = sum(1 for v in seq_to_instr.values() if v != "")
+        if not present:
+            return
+        self.max_seq = present[-1]
+        if len(present) != self.max_seq:   # otherwise contiguous, the common case
+            prev = 0
+            for seq in present:
+                if seq > prev + 1:
+                    self.gap_starts.append(prev + 1)
+                    self.gap_ends[prev + 1] = seq - 1
+                    self.gap_total += seq - 1 - prev
+                prev = seq
+        self._extend_prefix()
+
+    def _load_meta(self, pending_final_seq, final_seq, final_summary) -> None:
+        # The stored terminator may since have been overwritten by a real step
+        if self.seq_to_instr.get(pending_final_seq, "") == "":
+            self.pending_final_seq = pending_final_seq
+        if final_seq is not None:
+            MemoryStore.freeze(self, final_seq)
+        self.final_summary = final_summary
+
+
+class _GroupCommitStore(MemoryStore):
+    """
+    MemoryStore whose writes are also queued for a background writer thread.
+    MemoryStore indexes serve every read; the writer drains the queue in
+    group_commit_ms windows and persists each group with a single sync.
+    Requests wait on commit_point()/wait_committed() so a step is only
+    acknowledged once it is on disk, yet concurrent requests share one sync.
+    Subclasses implement _recover(), _write(ops) and _close().
+    """
+
+    def __init__(self, group_commit_ms: float = None):
+        self.window = (GROUP_COMMIT_MS if group_commit_ms is None else group_commit_ms) / 1000.0
+
+        self._queue = []
+        self._enqueued = 0          # ticket of the last queued write
+        self._committed = 0         # ticket of the last durable write
+        self._error = None
+        self._cond = Condition()
+        self._closed = False
+
+        self._recovering = True
+        MemoryStore.reset(self)
+        self._recover()
+        self._recovering = False
+
+        self._writer = Thread(target=self._write_loop, name=f"{type(self).__name__}-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    # ---- write path ----
+
+    def _enqueue(self, op: tuple) -> None:
+        with self._cond:
+            self._queue.append(op)
+            self._enqueued += 1
+            self._cond.notify_all()
+
+    def upsert(self, seq: int, instr: str) -> None:
+        MemoryStore.upsert(self, seq, instr)
+        self._enqueue(("upsert", seq, instr))
+
+    def set_pending(self, final_seq: int) -> None:
+        MemoryStore.set_pending(self, final_seq)
+        self._enqueue(("pending", final_seq))
+
+    def freeze(self, final_seq: int) -> None:
+        MemoryStore.freeze(self, final_seq)
+        self._enqueue(("freeze", final_seq))
+
+    def record_summary(self, summary: dict) -> None:
+        MemoryStore.record_summary(self, summary)
+        self._enqueue(("summary", summary))
+
+    def reset(self) -> None:
+        MemoryStore.reset(self)
+        self._enqueue(("reset",))
+
+    def commit_point(self) -> int:
+        with self._cond:
+            return self._enqueued
+
+    def wait_committed(self, ticket: int) -> None:
+        with self._cond:
+            while self._committed < ticket and self._error is None:
+                self._cond.wait()
+            if self._error is not None:
+                raise RuntimeError("instruction store write failed") from self._error
+
+    def _write_loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue and self._closed:
+                    return
+            # Let concurrent requests pile onto this commit
+            if self.window > 0 and not self._closed:
+                time.sleep(self.window)
+            with self._cond:
+                ops, self._queue = self._queue, []
+                ticket = self._enqueued
+            try:
+                self._write(ops)
+            except Exception as e:
+                # Any failure must reach waiters, or wait_committed() blocks forever
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                self._committed = ticket
+                self._cond.notify_all()
+
+    def close(self) -> None:
+        """Flush queued writes and stop the writer thread."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._writer.join()
+        self._close()
+
+    @abstractmethod
+    def _recover(self) -> None:
+        ...
+
+    @abstractmethod
+    def _write(self, ops: list) -> None:
+        ...
+
+    @abstractmethod
+    def _close(self) -> None:
+        ...
+
+
+class SqliteStore(_GroupCommitStore):
+    """
+    Durable store backed by a WAL-mode SQLite database. Each commit group is
+    one transaction, so durability costs one WAL fsync per group rather than
+    per step. On startup the indexes are rebuilt from the database.
+    """
+
+    def __init__(self, path: str = None, group_commit_ms: float = None):
+        self.path = path or SQLITE_PATH
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS steps (seq INTEGER PRIMARY KEY, instruction TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._db.commit()
+        super().__init__(group_commit_ms)
+
+    def _recover(self) -> None:
+        self._load(dict(self._db.execute("SELECT seq, instruction FROM steps ORDER BY seq")))
+        meta = dict(self._db.execute("SELECT key, value FROM meta"))
+        self._load_meta(
+            int(meta["pending_final_seq"]) if "pending_final_seq" in meta else None,
+            int(meta["final_seq"]) if "final_seq" in meta else None,
+            json.loads(meta["final_summary"]) if "final_summary" in meta else None,
+        )
+
+    def _write(self, ops: list) -> None:
+        upserts = []
+        with self._db:
+            for op in ops:
+                if op[0] == "upsert":
+                    upserts.append(op[1:])
+                    continue
+                if upserts:
+                    self._db.executemany("INSERT OR REPLACE INTO steps VALUES (?, ?)", upserts)
+                    upserts = []
+                if op[0] == "pending":
+                    self._set_meta("pending_final_seq", str(op[1]))
+                elif op[0] == "freeze":
+                    self._set_meta("final_seq", str(op[1]))
+                elif op[0] == "summary":
+                    self._set_meta("final_summary", json.dumps(op[1]))
+                elif op[0] == "reset":
+                    self._db.execute("DELETE FROM steps")
+                    self._db.execute("DELETE FROM meta")
+            if upserts:
+                self._db.executemany("INSERT OR REPLACE INTO steps VALUES (?, ?)", upserts)
+
+    def _set_meta(self, key: str, value: str) -> None:
+        self._db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def _close(self) -> None:
+        self._db.close()
+
+
+class LogStore(_GroupCommitStore):
+    """
+    Durable store backed by a binary append-only log in `log_dir`.
+
+    Each commit group is appended to the current log segment and fsynced
+    once. Every `snapshot_every` upserts the writer rolls over to a new
+    segment and a snapshot thread rebuilds the state as of that point from
+    the previous snapshot and the segments since, so nothing is copied under
+    store_lock; once the snapshot is on disk the older segments and snapshots
+    are deleted. Startup
+    loads the newest snapshot and replays only the segments written after it,
+    so recovery time is bounded by snapshot size plus one log tail.
+
+    Log record: struct LOG_HEADER (op, seq, payload length) + UTF-8 payload.
+    Snapshot: SNAPSHOT_MAGIC, a JSON header line, then seqs and instruction
+    lengths as int64 arrays followed by the concatenated instructions.
+    """
+
+    LOG_HEADER = struct.Struct("<BqI")
+    OP_UPSERT, OP_PENDING, OP_FREEZE, OP_SUMMARY, OP_RESET = range(1, 6)
+    SNAPSHOT_MAGIC = b"ISNAP1\n"
+
+    def __init__(self, log_dir: str = None, group_commit_ms: float = None, snapshot_every: int = None):
+        self.log_dir = log_dir or LOG_DIR
+        self.snapshot_every = SNAPSHOT_EVERY if snapshot_every is None else snapshot_every
+        os.makedirs(self.log_dir, exist_ok=True)
+        self._since_snapshot = 0
+        self._snapshotter = None
+        super().__init__(group_commit_ms)
+
+    def _path(self, kind: str, number: int) -> str:
+        return os.path.join(self.log_dir, f"{kind}.{number:08d}")
+
+    def _numbers(self, kind: str) -> list:
+        out = []
+        for name in os.listdir(self.log_dir):
+            prefix, _, number = name.partition(".")
+            if prefix == kind and number.isdigit():
+                out.append(int(number))
+        return sorted(out)
+
+    # ---- recovery ----
+
+    def _recover(self) -> None:
+        last = self._rebuild(self, None)
+
+        # Always append to a fresh segment so a torn tail is never extended
+        self._segment = last + 1
+        self._log = open(self._path("log", self._segment), "ab")
+
+    def _rebuild(self, into: MemoryStore, before) -> int:
+        """
+        Load the newest snapshot and replay the log segments after it into
+        `into`, stopping short of segment `before` (None: replay them all).
+        Returns the highest snapshot or segment number read (0 if none).
+        """
+        snapshots = [n for n in self._numbers("snapshot") if before is None or n < before]
+        base = snapshots[-1] if snapshots else 0
+        if snapshots:
+            self._load_snapshot(self._path("snapshot", base), into)
+        segments = [n for n in self._numbers("log") if n >= base and (before is None or n < before)]
+        for number in segments:
+            self._replay(self._path("log", number), into)
+        return max(segments + [base])
+
+    def _load_snapshot(self, path: str, into: MemoryStore) -> None:
+        with open(path, "rb") as f:
+            if f.readline() != self.SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} is not an instruction snapshot")
+            header = json.loads(f.readline())
+            n = header["count"]
+            seqs, lengths = array("q"), array("q")
+            seqs.fromfile(f, n)
+            lengths.fromfile(f, n)
+            text = f.read().decode("utf-8")
+        offsets = list(accumulate(lengths, initial=0))
+        into._load(dict(zip(seqs, [text[a:b] for a, b in zip(offsets, offsets[1:])])))
+        into._load_meta(header["pending_final_seq"], header["final_seq"], header["final_summary"])
+
+    def _replay(self, path: str, into: MemoryStore) -> None:
+        with open(path, "rb") as f:
+            data = f.read()
+        header = self.LOG_HEADER
+        pos = 0
+        while pos + header.size <= len(data):
+            op, seq, length = header.unpack_from(data, pos)
+            end = pos + header.size + length
+            if end > len(data):
+                break   # torn tail from a crash mid-append
+            payload = data[pos + header.size:end]
+            pos = end
+            if op == self.OP_UPSERT:
+                MemoryStore.upsert(into, seq, payload.decode("utf-8"))
+            elif op == self.OP_PENDING:
+                MemoryStore.set_pending(into, seq)
+            elif op == self.OP_FREEZE:
+                MemoryStore.freeze(into, seq)
+            elif op == self.OP_SUMMARY:
+                MemoryStore.record_summary(into, json.loads(payload))
+            elif op == self.OP_RESET:
+                MemoryStore.reset(into)
+
+    # ---- write path ----
+
+    def upsert(self, seq: int, instr: str) -> None:
+        super().upsert(seq, instr)
+        self._since_snapshot += 1
+        if (self.snapshot_every and self._since_snapshot >= self.snapshot_every
+                and not self._snapshot_running()):
+            # Only a marker: the snapshot thread rebuilds the state from disk
+            self._since_snapshot = 0
+            self._enqueue(("snapshot",))
+
+    def _snapshot_running(self) -> bool:
+        return self._snapshotter is not None and self._snapshotter.is_alive()
+
+    def _write(self, ops: list) -> None:
+        pack = self.LOG_HEADER.pack
+        buf = bytearray()
+        for op in ops:
+            kind = op[0]
+            if kind == "upsert":
+                payload = op[2].encode("utf-8")
+                buf += pack(self.OP_UPSERT, op[1], len(payload))
+                buf += payload
+            elif kind == "pending":
+                buf += pack(self.OP_PENDING, op[1], 0)
+            elif kind == "freeze":
+                buf += pack(self.OP_FREEZE, op[1], 0)
+            elif kind == "summary":
+                payload = json.dumps(op[1]).encode("utf-8")
+                buf += pack(self.OP_SUMMARY, 0, len(payload))
+                buf += payload
+            elif kind == "reset":
+                buf += pack(self.OP_RESET, 0, 0)
+            elif kind == "snapshot":
+                self._append(buf)
+                buf = bytearray()
+                self._start_snapshot()
+        self._append(buf)
+
+    def _append(self, buf: bytearray) -> None:
+        if buf:
+            self._log.write(buf)
+            self._log.flush()
+            os.fsync(self._log.fileno())
+
+    def _start_snapshot(self) -> None:
+        if self._snapshot_running():
+            return   # previous snapshot still being written; catch the next one
+        # Roll over: the snapshot covers everything before the new segment
+        self._log.close()
+        self._segment += 1
+        self._log = open(self._path("log", self._segment), "ab")
+        self._snapshotter = Thread(
+            target=self._write_snapshot, args=(self._segment,),
+            name="LogStore-snapshot", daemon=True,
+        )
+        self._snapshotter.start()
+
+    def _write_snapshot(self, number: int) -> None:
+        # Rebuilt from the files the writer has finished with, off store_lock
+        state = MemoryStore()
+        state._recovering = True
+        self._rebuild(state, number)
+        seq_to_instr = state.seq_to_instr
+        header = {
+            "count": len(seq_to_instr),
+            "pending_final_seq": state.pending_final_seq,
+            "final_seq": state.final_count + 1 if state.finalized else None,
+            "final_summary": state.final_summary,
+        }
+        seqs = array("q", sorted(seq_to_instr))
+        values = [seq_to_instr[s] for s in seqs]
+        lengths = array("q", map(len, values))
+        path = self._path("snapshot", number)
+        with open(path + ".tmp", "wb") as f:
+            f.write(self.SNAPSHOT_MAGIC)
+            f.write(json.dumps(header).encode("utf-8") + b"\n")
+            seqs.tofile(f)
+            lengths.tofile(f)
+            f.write("".join(values).encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+        # The snapshot supersedes every older snapshot and log segment
+        for n in self._numbers("snapshot"):
+            if n < number:
+                os.remove(self._path("snapshot", n))
+        for n in self._numbers("log"):
+            if n < number:
+                os.remove(self._path("log", n))
+
+    def _close(self) -> None:
+        if self._snapshotter is not None:
+            self._snapshotter.join()
+        self._log.close()
+
+
+STORES = {
+    "memory": MemoryStore,
+    "sqlite": SqliteStore,
+    "log": LogStore,
+}
+
+
+def make_store(name: str) -> InstructionStore:
+    try:
+        return STORES[name]()
+    except KeyError:
+        raise ValueError(f"unknown instruction store {name!r}; choose from {sorted(STORES)}") from None
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The service is a flat set of top-level modules (app, store, period, ...)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
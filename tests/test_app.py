@@ -0,0 +1,386 @@
+"""HTTP behaviour of the service on the default in-memory store."""
+import json
+import os
+import threading
+
+import pytest
+
+import app as service
+from frozen import FrozenRun
+from message import MessageIndex
+from period import PeriodCache
+import store as store_module
+from store import FrozenSteps, LogStore
+
+
+@pytest.fixture
+def client():
+    c = service.app.test_client()
+    c.post("/reset")
+    yield c
+    service.analysis_pool.submit(lambda: None).result()
+    c.post("/reset")
+
+
+def test_overwritten_terminator_does_not_freeze_the_run(client):
+    client.post("/instruction", json={"seq": 3, "instruction": ""})
+    client.post("/instruction", json={"seq": 3, "instruction": "c"})
+    resp = client.post("/instructions/batch", json=[
+        {"seq": 1, "instruction": "a"}, {"seq": 2, "instruction": "b"},
+    ])
+    assert resp.json["status"] == "accepted"
+    assert client.get("/count").json["instruction_count"] == 3
+
+
+def test_ndjson_stream_parsing(client, monkeypatch):
+    monkeypatch.setattr(service, "STREAM_MAX_LINE_BYTES", 64 * 1024)
+    monkeypatch.setattr(service, "STREAM_GROUP_SIZE", 2)
+    body = b"\n".join([
+        b'{"seq": 1, "instruction": "a"}',
+        b"",                                            # blank: skipped
+        b"not json",                                    # line 3
+        b'{"seq": 2, "instruction": "' + b"x" * 70000 + b'"}',  # line 4: too long
+        b'{"seq": "two", "instruction": "b"}',          # line 5: bad seq
+        b'{"seq": 3, "instruction": "\\ud800"}',        # line 6: not UTF-8
+        b"[" * 60000,                                   # line 7: nested too deep
+        b'{"seq": 2, "instruction": "b"}',
+        b'{"seq": 3, "instruction": "c"}',              # no trailing newline
+    ])
+    resp = client.post("/instructions/stream", data=body)
+    assert resp.status_code == 202
+    assert resp.json["accepted"] == 3
+    assert resp.json["rejected_count"] == 5
+    assert resp.json["rejected_first_10"] == [3, 4, 5, 6, 7]
+    assert resp.json["watermark"] == 3
+
+
+def test_ndjson_stream_finalizes(client):
+    lines = [b'{"seq": %d, "instruction": "ab"}' % i for i in (2, 1)] + [b'{"seq": 3, "instruction": ""}']
+    resp = client.post("/instructions/stream", data=b"\n".join(lines) + b"\n")
+    assert resp.status_code == 200
+    assert resp.json["finalized"] is True
+    assert resp.json["finalization"]["steps_counted"] == 2
+
+
+def test_batch_and_single_reject_non_utf8(client):
+    resp = client.post("/instruction", data=b'{"seq": 1, "instruction": "\\ud800"}',
+                       content_type="application/json")
+    assert resp.status_code == 400
+    resp = client.post("/instructions/batch", data=b'[{"seq": 1, "instruction": "\\udfff"}]',
+                       content_type="application/json")
+    assert resp.json["rejected"] == [0]
+
+
+def test_reset_during_analysis_drops_the_frozen_run(client, monkeypatch, tmp_path):
+    path = str(tmp_path / "run.frozen")
+    monkeypatch.setattr(service, "FROZEN_RUN_PATH", path)
+    in_period, in_serialize = threading.Event(), threading.Event()
+    resume_period, resume_serialize = threading.Event(), threading.Event()
+    real_period, real_serialize = service.instruction_period, service._serialize_final
+
+    def paused_period(instructions):
+        in_period.set()
+        resume_period.wait(5)
+        return real_period(instructions)
+
+    def paused_serialize(*args, **kwargs):
+        # The frozen file has been written by now
+        in_serialize.set()
+        resume_serialize.wait(5)
+        return real_serialize(*args, **kwargs)
+
+    monkeypatch.setattr(service, "instruction_period", paused_period)
+    monkeypatch.setattr(service, "_serialize_final", paused_serialize)
+    steps = [{"seq": i, "instruction": "ab"} for i in range(1, 51)]
+    resp = client.post("/instructions/batch", json=steps + [{"seq": 51, "instruction": ""}])
+    assert resp.json["finalization"]["analysis"] == "pending"
+
+    try:
+        assert in_period.wait(5)
+        client.post("/reset")
+        resume_period.set()
+        assert in_serialize.wait(5)
+        # The worker still holds the reset run: reads must not re-adopt it
+        assert client.get("/count").json["status"] == "in-progress"
+        assert client.post("/instruction", json={"seq": 1, "instruction": "a"}).status_code == 202
+    finally:
+        resume_period.set()
+        resume_serialize.set()
+        service.analysis_pool.submit(lambda: None).result()
+
+    assert not os.listdir(tmp_path)
+    assert client.get("/count").json["instruction_count"] == 1
+
+
+def test_frozen_run_is_written_and_adopted(client, monkeypatch, tmp_path):
+    path = str(tmp_path / "run.frozen")
+    monkeypatch.setattr(service, "FROZEN_RUN_PATH", path)
+    steps = [{"seq": i, "instruction": "é%d" % (i % 3)} for i in range(1, 31)]
+    client.post("/instructions/batch", json=steps + [{"seq": 31, "instruction": ""}])
+    service.analysis_pool.submit(lambda: None).result()
+    assert os.listdir(tmp_path) == ["run.frozen"]
+    assert isinstance(service.store.final_instructions, FrozenRun)
+    assert client.get("/analysis").json["repeating_unit_steps"] == 3
+
+
+def test_reads_before_analysis_completes_are_not_cached(client, monkeypatch):
+    in_period, resume = threading.Event(), threading.Event()
+    real_period = service.instruction_period
+
+    def paused_period(instructions):
+        in_period.set()
+        resume.wait(5)
+        return real_period(instructions)
+
+    monkeypatch.setattr(service, "instruction_period", paused_period)
+    steps = [{"seq": i, "instruction": "ab"[i % 2]} for i in range(1, 21)]
+    client.post("/instructions/batch", json=steps + [{"seq": 21, "instruction": ""}])
+    try:
+        assert in_period.wait(5)
+        count = client.get("/count")
+        assert count.json["finalization"]["analysis"] == "pending"
+        listing = client.get("/instructions?concat=true")
+        assert listing.json["message"] == "ba" * 10
+        assert client.get("/analysis/period").status_code == 202
+        assert not service.final_responses
+        assert isinstance(service.store.final_instructions, FrozenSteps)
+    finally:
+        resume.set()
+        service.analysis_pool.submit(lambda: None).result()
+
+    assert service.store.final_instructions == ["ab"[i % 2] for i in range(1, 21)]
+    ready = client.get("/count", headers={"If-None-Match": count.headers["ETag"]})
+    assert ready.status_code == 200
+    assert ready.json["finalization"]["repeating_unit_length"] == 2
+    listing_ready = client.get("/instructions?concat=true")
+    assert listing_ready.json["instructions"] == listing.json["instructions"]
+    assert client.get("/analysis/period").json["repeat_count"] == 10
+
+
+def test_failed_analysis_is_reported(client, monkeypatch):
+    def broken_period(instructions):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(service, "instruction_period", broken_period)
+    client.post("/instructions/batch", json=[
+        {"seq": 1, "instruction": "ab"}, {"seq": 2, "instruction": ""},
+    ])
+    service.analysis_pool.submit(lambda: None).result()
+
+    status = client.get("/analysis")
+    assert status.status_code == 200
+    assert status.json["analysis"] == "failed"
+    assert "boom" in status.json["error"]
+    assert client.get("/analysis/period").status_code == 500
+    assert client.get("/instructions?concat=true").json["message"] == "ab"
+
+
+def test_period_unit_ending_on_a_step_boundary_is_a_seq_span(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(service, "FROZEN_RUN_PATH", str(tmp_path / "run.frozen"))
+    steps = [{"seq": i + 1, "instruction": s} for i, s in enumerate(["abc", "ab", "cab", "c", "abc"])]
+    client.post("/instructions/batch", json=steps + [{"seq": 6, "instruction": ""}])
+    service.analysis_pool.submit(lambda: None).result()
+
+    period = client.get("/analysis/period").json
+    assert period["unit_span"] == {"from": 1, "to": 1, "steps": 1}
+    assert period["repeat_count"] == 4
+    with service.store_lock:
+        frozen, summary = service.store.final_instructions, service.store.final_summary
+        body = service._serialize_final(frozen, summary)["period"][0]
+    assert isinstance(frozen, FrozenRun)
+    assert json.loads(body)["unit_span"] == period["unit_span"]
+
+
+def _pages(client, query: str, size: int) -> list:
+    pages, lo = [], 1
+    while lo is not None:
+        page = client.get(f"/instructions?{query}&from={lo}&to={lo + size - 1}").json
+        pages.append(page)
+        lo = page["next_from"]
+    return pages
+
+
+@pytest.mark.parametrize("stream", ["false", "true"])
+def test_paging_covers_the_run_with_one_meaning_of_count(client, stream):
+    present = {1: "a", 2: "bé", 4: "c", 7: "d", 8: "e", 12: "f"}
+    client.post("/instructions/batch", json=[{"seq": s, "instruction": v} for s, v in present.items()])
+    query = f"concat=true&stream={stream}"
+    full = client.get(f"/instructions?{query}").json
+    assert full["count"] == 6
+
+    pages = _pages(client, query, 3)
+    assert [p["count"] for p in pages] == [6] * len(pages)
+    assert [p["window_count"] for p in pages] == [2, 1, 2, 1]
+    assert sum((p["instructions"] for p in pages), []) == full["instructions"]
+    assert sum((p["missing"] for p in pages), []) == full["missing"]
+    assert "".join(p["message"] for p in pages) == full["message"]
+    beyond = client.get(f"/instructions?{query}&from=20").json
+    assert beyond["instructions"] == [] and beyond["missing"] == [] and beyond["window_count"] == 0
+
+    client.post("/instructions/batch", json=[{"seq": s, "instruction": "x"} for s in (3, 5, 6, 9, 10, 11)]
+                + [{"seq": 13, "instruction": ""}])
+    service.analysis_pool.submit(lambda: None).result()
+    full = client.get(f"/instructions?{query}").json
+    pages = _pages(client, query, 5)
+    assert [p["count"] for p in pages] == [12] * 3
+    assert [p["window_count"] for p in pages] == [5, 5, 2]
+    assert sum((p["instructions"] for p in pages), []) == full["instructions"]
+    assert "".join(p["message"] for p in pages) == full["message"]
+
+
+def test_message_slices_follow_the_contiguous_prefix(client):
+    client.post("/instructions/batch", json=[
+        {"seq": 1, "instruction": "ab"}, {"seq": 2, "instruction": "é"}, {"seq": 4, "instruction": "zz"},
+    ])
+    live = client.get("/message?offset=1&length=5").json
+    assert live["status"] == "in-progress" and live["message_length"] == 3
+    assert (live["text"], live["first_seq"], live["last_seq"]) == ("bé", 1, 2)
+    assert client.get("/message?offset=3").json["text"] == ""
+    assert client.get("/message?offset=-1").status_code == 400
+
+    client.post("/instructions/batch", json=[{"seq": 3, "instruction": "c"}, {"seq": 5, "instruction": ""}])
+    final = client.get("/message?offset=2&length=3").json
+    assert final["status"] == "final" and final["message_length"] == 6
+    assert (final["text"], final["first_seq"], final["last_seq"]) == ("écz", 2, 4)
+
+
+def test_raw_message_ranges(client):
+    client.post("/instructions/batch", json=[{"seq": 1, "instruction": "aé"}, {"seq": 2, "instruction": "bc"}])
+    full = client.get("/message/raw")
+    assert full.status_code == 200 and full.data == "aébc".encode()
+    assert client.get("/message/raw", headers={"If-None-Match": full.headers["ETag"]}).status_code == 304
+
+    part = client.get("/message/raw", headers={"Range": "bytes=1-3"})
+    assert part.status_code == 206
+    assert part.data == "é".encode() + b"b"
+    assert part.headers["Content-Range"] == "bytes 1-3/5"
+    past = client.get("/message/raw", headers={"Range": "bytes=10-20"})
+    assert past.status_code == 416 and past.headers["Content-Range"] == "bytes */5"
+
+    client.post("/instruction", json={"seq": 3, "instruction": "d"})
+    assert client.get("/message/raw").data == "aébcd".encode()
+    client.post("/reset")
+    assert service._raw_message_cache["body"] == b""
+    assert client.get("/message/raw").data == b""
+
+
+@pytest.mark.parametrize("query", [
+    "", "concat=true", "missing=ranges&concat=true", "from=2&to=5&concat=true", "from=4",
+])
+def test_streamed_body_is_byte_identical(client, monkeypatch, query):
+    monkeypatch.setattr(service, "STREAM_RESPONSE_CHUNK", 2)
+    client.post("/instructions/batch", json=[
+        {"seq": s, "instruction": v} for s, v in [(1, "a"), (2, "bé"), (4, "\"q\""), (6, "d")]
+    ])
+    for _ in ("live", "final"):
+        buffered = client.get(f"/instructions?{query}")
+        streamed = client.get(f"/instructions?{query}&stream=true")
+        assert streamed.data == buffered.data
+        assert streamed.headers["ETag"] == buffered.headers["ETag"]
+        client.post("/instructions/batch", json=[
+            {"seq": 3, "instruction": "c"}, {"seq": 5, "instruction": "e"}, {"seq": 7, "instruction": ""},
+        ])
+        service.analysis_pool.submit(lambda: None).result()
+
+
+@pytest.fixture
+def early(client, monkeypatch):
+    monkeypatch.setattr(service, "EARLY_PERIOD_REPEATS", 3)
+    monkeypatch.setattr(store_module, "ONLINE_PERIOD", True)
+    client.post("/reset")
+    return client
+
+
+def _add(client, first: int, steps: list) -> None:
+    client.post("/instructions/batch", json=[{"seq": first + i, "instruction": s} for i, s in enumerate(steps)])
+
+
+def test_early_period_goes_from_tracking_to_stable(early):
+    _add(early, 1, ["ab", "ab"])
+    report = early.get("/count").json["early_period"]
+    assert (report["status"], report["repeat_count"]) == ("tracking", 2)
+    assert "unit_span" not in report and "unit" not in report
+
+    _add(early, 3, ["ab"])
+    report = early.get("/count").json["early_period"]
+    assert report["status"] == "stable"
+    assert report["unit_span"] == {"from": 1, "to": 1, "steps": 1}
+    period = early.get("/analysis/period")
+    assert period.status_code == 202 and period.json["analysis"] == "provisional"
+
+
+def test_early_period_reports_text_when_the_unit_splits_a_step(early):
+    _add(early, 1, ["a", "bab", "ab"])
+    report = early.get("/analysis/period").json
+    assert report["status"] == "stable"
+    assert report["unit"] == "ab" and "unit_span" not in report
+
+
+def test_early_period_survives_durable_recovery(early, monkeypatch, tmp_path):
+    durable = LogStore(str(tmp_path), 0)
+    for seq in range(1, 5):
+        durable.upsert(seq, "xy")
+    durable.close()
+    durable = LogStore(str(tmp_path), 0)
+    try:
+        assert durable.prefix.kmp is None
+        monkeypatch.setattr(service, "store", durable)
+        with service.store_lock:
+            service._resume_early_period()
+        report = early.get("/count").json["early_period"]
+        assert (report["status"], report["repeat_count"], report["unit_length"]) == ("stable", 4, 2)
+    finally:
+        durable.close()
+
+
+def test_mapped_run_listings_are_streamed_not_kept(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(service, "FROZEN_RUN_PATH", str(tmp_path / "run.frozen"))
+    monkeypatch.setattr(service, "STREAM_RESPONSE_CHUNK", 3)
+    steps = ["é%d" % i for i in range(10)]
+    _add(client, 1, steps + [""])
+    service.analysis_pool.submit(lambda: None).result()
+
+    with service.store_lock:
+        frozen, summary = service.store.final_instructions, service.store.final_summary
+        kept = dict(service.final_responses)
+        buffered = service._serialize_final(list(frozen), summary, streamed=False)
+    assert isinstance(frozen, FrozenRun)
+    assert frozen[2:7] == steps[2:7] and frozen[::3] == steps[::3]
+    for variant, query in (("instructions", ""), ("instructions+concat", "?concat=true")):
+        assert kept[variant][0] is None
+        resp = client.get("/instructions" + query)
+        assert resp.data == buffered[variant][0]
+        assert resp.headers["ETag"].strip('"') == buffered[variant][1] == kept[variant][1]
+        assert client.get("/instructions" + query, headers={"If-None-Match": resp.headers["ETag"]}).status_code == 304
+
+
+def test_period_cache_counts_and_adopted_runs(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(service, "period_cache", PeriodCache(4))
+    steps = ["ab", "c"] * 5 + [""]
+    for _ in range(2):
+        client.post("/reset")
+        _add(client, 1, steps)
+        service.analysis_pool.submit(lambda: None).result()
+    assert client.get("/analysis").json["period_cache"] == {"hits": 1, "misses": 1, "size": 1, "maxsize": 4}
+
+    # A process that adopts the run from FROZEN_RUN_PATH seeds its own cache
+    monkeypatch.setattr(service, "FROZEN_RUN_PATH", str(tmp_path / "run.frozen"))
+    client.post("/reset")
+    _add(client, 1, ["x", "yz"] * 3 + [""])
+    service.analysis_pool.submit(lambda: None).result()
+    monkeypatch.setattr(service, "period_cache", PeriodCache(4))
+    with service.store_lock:
+        service.store.reset()
+        service._adopt_frozen_run()
+    service.analysis_pool.submit(lambda: None).result()
+    with service.store_lock:
+        frozen = service.store.final_instructions
+        assert isinstance(frozen, FrozenRun)
+        index = MessageIndex(track_period=False)
+        for instr in frozen:
+            index.append(instr)
+        assert frozen.digest(len(frozen)) == index.digest(len(frozen))
+    client.post("/reset")
+    _add(client, 1, ["x", "yz"] * 3 + [""])
+    service.analysis_pool.submit(lambda: None).result()
+    assert client.get("/analysis").json["period_cache"]["hits"] == 1
@@ -0,0 +1,123 @@
+"""Durable stores: recovery must rebuild exactly the state a MemoryStore holds."""
+import random
+import threading
+
+import pytest
+
+from app import MIN_SEQ, _parse_step
+from store import LogStore, MemoryStore, SqliteStore
+
+
+def state(s) -> tuple:
+    return (s.seq_to_instr, s.live_count, s.max_key, s.max_seq, s.gap_starts, s.gap_ends,
+            s.gap_total, s.pending_final_seq, s.finalized, s.final_instructions, s.final_summary)
+
+
+def opener(kind: str, tmp_path, rng):
+    if kind == "log":
+        snapshot_every = rng.choice([0, 3, 7, 50])
+        return lambda: LogStore(str(tmp_path / "log"), 0, snapshot_every=snapshot_every)
+    return lambda: SqliteStore(str(tmp_path / "steps.db"), 0)
+
+
+@pytest.mark.parametrize("kind", ["log", "sqlite"])
+@pytest.mark.parametrize("seed", range(8))
+def test_recovery_matches_memory_store(kind, seed, tmp_path):
+    rng = random.Random(seed)
+    reopen = opener(kind, tmp_path, rng)
+    durable, ref = reopen(), MemoryStore()
+    try:
+        for _ in range(rng.randint(1, 200)):
+            if durable.finalized:
+                break
+            seq, instr = rng.randint(-1, 40), rng.choice(["", "a", "bé", "c"])
+            r = rng.random()
+            if r < 0.02:
+                durable.reset()
+                ref.reset()
+                continue
+            if r < 0.05:
+                for s in (durable, ref):
+                    s.upsert(seq, "")
+                    s.set_pending(seq)
+                continue
+            durable.upsert(seq, instr)
+            ref.upsert(seq, instr)
+            if rng.random() < 0.05 and ref.pending_final_seq and ref.watermark() >= ref.pending_final_seq - 1:
+                for s in (durable, ref):
+                    s.freeze(ref.pending_final_seq)
+                    s.record_summary({"status": "finalized"})
+            if rng.random() < 0.1:
+                durable.wait_committed(durable.commit_point())
+                durable.close()
+                durable = reopen()
+                assert state(durable) == state(ref)
+        durable.close()
+        durable = reopen()
+        assert state(durable) == state(ref)
+    finally:
+        durable.close()
+
+
+@pytest.mark.parametrize("kind", ["log", "sqlite"])
+def test_write_failure_reaches_waiters(kind, tmp_path):
+    durable = opener(kind, tmp_path, random.Random(0))()
+    durable.upsert(1, "\ud800")     # not encodable: the writer's _write raises
+    outcome = []
+
+    def wait():
+        try:
+            durable.wait_committed(durable.commit_point())
+        except RuntimeError as e:
+            outcome.append(e)
+
+    waiter = threading.Thread(target=wait, daemon=True)
+    waiter.start()
+    waiter.join(5)
+    assert not waiter.is_alive(), "wait_committed() hung after a failed write"
+    assert outcome and isinstance(outcome[0].__cause__, UnicodeEncodeError)
+    durable.close()
+
+
+@pytest.mark.parametrize("kind", ["log", "sqlite"])
+def test_out_of_range_seq_never_reaches_the_writer(kind, tmp_path):
+    with pytest.raises(ValueError):
+        _parse_step({"seq": MIN_SEQ - 1, "instruction": "a"})
+    durable = opener(kind, tmp_path, random.Random(0))()
+    try:
+        durable.upsert(*_parse_step({"seq": MIN_SEQ, "instruction": "a"}))
+        durable.wait_committed(durable.commit_point())
+        durable.close()
+        durable = opener(kind, tmp_path, random.Random(0))()
+        assert durable.seq_to_instr == {MIN_SEQ: "a"}
+    finally:
+        durable.close()
+
+
+def test_log_snapshot_is_rebuilt_from_disk_off_the_lock(tmp_path, monkeypatch):
+    release = threading.Event()
+    real_rebuild = LogStore._rebuild
+
+    def gated(self, into, before):
+        if into is not self:    # the snapshot thread, not recovery
+            release.wait(5)
+        return real_rebuild(self, into, before)
+
+    monkeypatch.setattr(LogStore, "_rebuild", gated)
+    durable, ref = LogStore(str(tmp_path), 0, snapshot_every=3), MemoryStore()
+    try:
+        for seq in range(1, 20):
+            for s in (durable, ref):
+                s.upsert(seq, "x%d" % seq)
+        durable.wait_committed(durable.commit_point())
+        # Thresholds passed while the first snapshot is pending queue nothing
+        assert durable._snapshot_running()
+        assert durable._numbers("log") == [1, 2]
+        release.set()
+        durable.close()
+        assert durable._numbers("snapshot") == [2] and durable._numbers("log") == [2]
+        durable = LogStore(str(tmp_path), 0, snapshot_every=3)
+        assert state(durable) == state(ref)
+    finally:
+        release.set()
+        durable.close()
@@ -0,0 +1,119 @@
+"""
+Differential tests: every period variant must agree with the reference KMP
+repeating_unit_length() on random and adversarial inputs.
+"""
+import random
+
+import pytest
+
+import period
+from period import (
+    PERIOD_ALGORITHMS,
+    PeriodCache,
+    PrefixFunction,
+    instruction_period,
+    message_period,
+    parallel_unit_length,
+    repeating_unit_length,
+)
+
+
+def fibonacci_word(n: int) -> str:
+    a, b = "a", "ab"
+    while len(b) < n:
+        a, b = b, b + a
+    return b[:n]
+
+
+def adversarial_cases() -> list:
+    """Inputs that stress the failure paths of each algorithm."""
+    cases = ["", "a", "aa", "ab", "aab", "aba", "é", "éé", "aé" * 5, "\U0001F600" * 4]
+    for n in (1, 2, 3, 12, 97, 360, 1024, 5040):
+        cases += [
+            "a" * n,                            # every divisor works
+            "a" * (n - 1) + "b",                # long match, fails at the last char
+            "b" + "a" * (n - 1),
+            ("ab" * n)[:n],                     # period 2 that may not divide n
+            fibonacci_word(n),                  # aperiodic, long borders
+            ("abc" * n)[:n] + "abc"[n % 3],     # almost periodic
+        ]
+        unit = "".join(random.Random(n).choice("ab") for _ in range(max(n // 6, 1)))
+        cases.append(unit * 6)
+        cases.append(unit * 5 + unit[:-1] + ("a" if unit[-1] == "b" else "b"))
+    return cases
+
+
+def random_cases(count: int, seed: int) -> list:
+    rng = random.Random(seed)
+    cases = []
+    for _ in range(count):
+        unit = "".join(rng.choice("abé") for _ in range(rng.randint(1, 8)))
+        s = unit * rng.randint(1, 12)
+        if s and rng.random() < 0.3:
+            i = rng.randrange(len(s))
+            s = s[:i] + rng.choice("abé") + s[i + 1:]
+        cases.append(s)
+    return cases
+
+
+CASES = adversarial_cases() + random_cases(3000, 2024)
+
+
+@pytest.mark.parametrize("name", sorted(PERIOD_ALGORITHMS))
+def test_variant_matches_kmp(name):
+    fn = PERIOD_ALGORITHMS[name]
+    for s in CASES:
+        assert fn(s) == repeating_unit_length(s), (name, s[:40], len(s))
+
+
+def test_divisor_without_numpy(monkeypatch):
+    monkeypatch.setattr(period, "numpy", None)
+    for s in CASES:
+        assert period.divisor_unit_length(s) == repeating_unit_length(s), s[:40]
+
+
+def test_parallel_pool_matches_kmp():
+    # min_chars=0 forces the process pool even for short inputs
+    for s in adversarial_cases()[:40] + random_cases(30, 22):
+        assert parallel_unit_length(s, workers=3, min_chars=0) == repeating_unit_length(s), s[:40]
+
+
+def test_prefix_function_matches_kmp():
+    rng = random.Random(18)
+    for s in random_cases(300, 18):
+        pf = PrefixFunction()
+        pos = 0
+        while pos < len(s):
+            step = rng.randint(1, 4)
+            pf.extend(s[pos:pos + step])
+            pos += step
+            assert pf.unit_length() == repeating_unit_length(s[:pos])
+        cut = rng.randint(0, len(s))
+        pf.truncate(cut)
+        assert pf.unit_length() == repeating_unit_length(s[:cut])
+
+
+def test_instruction_period():
+    assert instruction_period([]) == 0
+    assert instruction_period(["ab", "c"] * 5) == 2
+    assert instruction_period(["ab", "c", "ab"]) == 3
+    # The character unit may be shorter than the instruction unit's text
+    assert message_period(["ab", "a", "b"] * 4) == (3, 2)
+
+
+def test_period_cache_evicts_least_recently_used():
+    cache = PeriodCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1      # "a" is now the most recent
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats() == {"hits": 3, "misses": 1, "size": 2, "maxsize": 2}
+
+
+def test_period_cache_size_zero_stores_nothing():
+    cache = PeriodCache(0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+    assert cache.stats() == {"hits": 0, "misses": 1, "size": 0, "maxsize": 0}
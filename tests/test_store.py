@@ -0,0 +1,124 @@
+"""MemoryStore completeness tracking against a brute-force model."""
+import random
+
+import pytest
+
+from message import MessageIndex
+from store import FrozenSteps, InstructionStore, MemoryStore, _GroupCommitStore
+
+
+def brute_force(model: dict) -> dict:
+    present = {s for s, v in model.items() if v != "" and s >= 1}
+    max_seq = max(present, default=0)
+    watermark = 0
+    while watermark + 1 in present:
+        watermark += 1
+    return {"present": present, "max_seq": max_seq, "watermark": watermark}
+
+
+def gaps_of(missing: list) -> list:
+    ranges = []
+    for m in missing:
+        if ranges and ranges[-1][1] == m - 1:
+            ranges[-1][1] = m
+        else:
+            ranges.append([m, m])
+    return ranges
+
+
+def test_gap_intervals_match_brute_force():
+    rng = random.Random(1)
+    for _ in range(200):
+        store, model = MemoryStore(), {}
+        for _ in range(60):
+            seq = rng.randint(-1, 30)
+            instr = rng.choice(["", "a", "bé"])
+            store.upsert(seq, instr)
+            model[seq] = instr
+            ref = brute_force(model)
+
+            assert store.max_seq == ref["max_seq"]
+            assert store.watermark() == ref["watermark"]
+            assert store.live_count == sum(1 for v in model.values() if v != "")
+            assert store.gap_total == ref["max_seq"] - len(ref["present"])
+
+            limit = rng.randint(0, 35)
+            start = rng.randint(1, 35)
+            missing = [s for s in range(start, limit + 1) if s not in ref["present"]]
+            assert store.gap_ranges(limit, start) == gaps_of(missing)
+            assert store.present_runs(limit, start) == [
+                tuple(r) for r in gaps_of([s for s in range(start, min(limit, ref["max_seq"]) + 1)
+                                           if s in ref["present"]])
+            ]
+            final_seq = rng.randint(1, 35)
+            below = [s for s in range(1, final_seq) if s not in ref["present"]]
+            assert store.missing_before(final_seq) == len(below)
+            assert store.first_missing_before(final_seq, 10) == below[:10]
+
+
+def test_prefix_index_follows_watermark():
+    rng = random.Random(16)
+    store, model = MemoryStore(), {}
+    for _ in range(2000):
+        seq = rng.randint(1, 40)
+        instr = rng.choice(["", "a", "bé", "cd"])
+        store.upsert(seq, instr)
+        model[seq] = instr
+        wm = store.watermark()
+        assert store.prefix.steps == wm
+        assert store.prefix.steps_text(1, wm) == "".join(model[i] for i in range(1, wm + 1))
+
+
+def test_overwritten_terminator_is_no_longer_pending():
+    store = MemoryStore()
+    store.upsert(3, "")
+    store.set_pending(3)
+    store.upsert(3, "c")
+    assert store.pending_final_seq is None
+    store.upsert(1, "a")
+    store.upsert(2, "b")
+    assert store.pending_final_seq is None
+
+
+def test_freeze_records_a_view_of_the_live_map():
+    store = MemoryStore()
+    for seq, instr in [(2, "b"), (1, "a"), (3, "c"), (5, "z"), (4, "")]:
+        store.upsert(seq, instr)
+    store.freeze(4)
+    frozen = store.final_instructions
+    assert isinstance(frozen, FrozenSteps)
+    assert store.final_count == len(frozen) == 3
+    assert list(frozen) == ["a", "b", "c"]
+    assert frozen[1:] == ["b", "c"] and frozen[::-1] == ["c", "b", "a"]
+    assert frozen[0] == "a" and frozen[-1] == "c"
+    with pytest.raises(IndexError):
+        frozen[3]
+    store.reset()
+    assert list(frozen) == ["a", "b", "c"]
+
+
+def test_message_pieces_cover_any_prefix():
+    rng = random.Random(17)
+    index, text = MessageIndex(chunk_chars=4, track_period=False), ""
+    for _ in range(60):
+        instr = rng.choice(["", "a", "bé", "cdefg"])
+        index.append(instr)
+        text += instr
+        stop = rng.randint(0, len(text) + 2)
+        assert "".join(index.pieces(stop)) == text[:stop]
+
+
+def test_incomplete_backends_fail_when_created():
+    class NoReset(MemoryStore):
+        reset = InstructionStore.reset
+
+    class NoWriter(_GroupCommitStore):
+        def _recover(self):
+            pass
+
+        def _close(self):
+            pass
+
+    for backend in (NoReset, NoWriter):
+        with pytest.raises(TypeError, match="abstract"):
+            backend()